@@ -1,18 +1,49 @@
 import os
 import sys
+import time
+launch_time = time.time()  # Taken before the heavier imports below, which are part of startup too
+import queue
+import atexit
+import json
+import random
+import argparse
 import sqlite3
+import re
+import struct
+import hashlib
+import hmac
+import signal
+import socket
+import asyncio
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from array import array
+from itertools import accumulate
+from collections import OrderedDict, deque
+import numpy as np
 import pygame
-from PyQt6.QtWidgets import QApplication, QDialog, QFormLayout, QLineEdit, QPushButton, QMessageBox, QLCDNumber
-from PyQt6.QtCore import pyqtSignal, QObject
+from PyQt6.QtWidgets import (QApplication, QDialog, QFormLayout, QLineEdit, QPushButton, QMessageBox, QLCDNumber,
+                             QListWidget, QLabel)
+from PyQt6.QtCore import pyqtSignal, QObject, QTimer, QRunnable, QThreadPool
 import threading
+import multiprocessing
 
 DATABASE_FILE = "wallet.db"
+SCORE_UPDATES_PER_SECOND = 10  # How often the menu picks up the running game's score
+
+# pygame is only initialized (by startGame, in the game process) when a game is played, so the
+# login window does not wait for audio, video and joystick setup it never uses.
+# PACMAN_WARMUP=0 stops the menu from starting the next game process in the background.
+WARM_UP = os.environ.get("PACMAN_WARMUP", "1") != "0"
+# PACMAN_STARTUP=startup.jsonl reports time to the login window and to each game's first frame
+STARTUP_REPORT = os.environ.get("PACMAN_STARTUP")
 
-pygame.init()
 black = (0, 0, 0)
 white = (255, 255, 255)
 blue = (0, 0, 255)
 red = (255, 0, 0)
+yellow = (255, 255, 0)
 
 
 def initialize_database():
@@ -26,37 +57,372 @@ def initialize_database():
             best_score INTEGER DEFAULT 0
         )
     ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            score INTEGER NOT NULL,
+            won INTEGER DEFAULT 0,
+            played_at REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS games_by_user ON games (username, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS users_by_best_score ON users (best_score DESC, username)')
+
+    # Number of users per best_score, kept in sync by triggers. Scores are bounded by the pellet
+    # count, so a user's rank is a sum over a few hundred rows however many users there are.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS score_counts (
+            score INTEGER PRIMARY KEY,
+            users INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('SELECT COUNT(*) FROM score_counts')
+    if cursor.fetchone()[0] == 0:
+        cursor.execute('''
+            INSERT INTO score_counts (score, users)
+            SELECT IFNULL(best_score, 0), COUNT(*) FROM users GROUP BY IFNULL(best_score, 0)
+        ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS score_counts_insert AFTER INSERT ON users
+        BEGIN
+            INSERT OR IGNORE INTO score_counts (score) VALUES (IFNULL(NEW.best_score, 0));
+            UPDATE score_counts SET users = users + 1 WHERE score = IFNULL(NEW.best_score, 0);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS score_counts_update AFTER UPDATE OF best_score ON users
+        WHEN IFNULL(OLD.best_score, 0) != IFNULL(NEW.best_score, 0)
+        BEGIN
+            UPDATE score_counts SET users = users - 1 WHERE score = IFNULL(OLD.best_score, 0);
+            INSERT OR IGNORE INTO score_counts (score) VALUES (IFNULL(NEW.best_score, 0));
+            UPDATE score_counts SET users = users + 1 WHERE score = IFNULL(NEW.best_score, 0);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS score_counts_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE score_counts SET users = users - 1 WHERE score = IFNULL(OLD.best_score, 0);
+        END
+    ''')
     conn.commit()
     conn.close()
 
 
+# Passwords are stored as scrypt$n$r$p$salt$hash. Raising the cost re-hashes a password with the
+# new settings the next time its owner logs in; accounts from before hashing are upgraded the same way.
+PASSWORD_COST = (2 ** 14, 8, 1)  # scrypt n, r, p: about 16 MB and 50 ms per hash
+PASSWORD_SALT_BYTES = 16
+
+
+def hash_password(password, cost=None):
+    n, r, p = cost or PASSWORD_COST
+    salt = os.urandom(PASSWORD_SALT_BYTES)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=32)
+    return f"scrypt${n}${r}${p}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, stored):
+    # Returns (matches, should be re-hashed with the current cost)
+    if not stored or not stored.startswith("scrypt$"):
+        return stored is not None and hmac.compare_digest(stored.encode(), password.encode()), True
+    _, n, r, p, salt, digest = stored.split("$")
+    n, r, p = int(n), int(r), int(p)
+    candidate = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=n, r=r, p=p,
+                               maxmem=256 * n * r * p, dklen=32)
+    matches = hmac.compare_digest(candidate, bytes.fromhex(digest))
+    return matches, matches and (n, r, p) != tuple(PASSWORD_COST)
+
+
+class AccountStore:
+    # Account queries over a small pool of SQLite connections, callable from any thread. sqlite3
+    # keeps each connection's compiled statements, so the fixed SQL below is prepared once per
+    # connection rather than once per call.
+    def __init__(self, database_file, size=4):
+        self.database_file = database_file
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.slots = threading.Semaphore(size)
+        self.score_client = None  # Connection to SCORE_SERVER for ranking reads, once needed
+
+    @contextmanager
+    def connection(self):
+        self.slots.acquire()
+        try:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = sqlite3.connect(self.database_file, timeout=30.0, check_same_thread=False, cached_statements=64)
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self.idle.put(conn)
+        finally:
+            self.slots.release()
+
+    def verify(self, username, password):
+        with self.connection() as conn:
+            row = conn.execute('SELECT password FROM users WHERE username = ?', (username,)).fetchone()
+            if row is None:
+                hash_password(password)  # Same cost as a real check, so unknown names are not revealed by timing
+                return False
+            matches, rehash = verify_password(password, row[0])
+            if matches and rehash:
+                conn.execute('UPDATE users SET password = ? WHERE username = ?', (hash_password(password), username))
+                conn.commit()
+            return matches
+
+    def register(self, username, password):
+        # False when the name is taken
+        hashed = hash_password(password)
+        with self.connection() as conn:
+            try:
+                conn.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, hashed))
+            except sqlite3.IntegrityError:
+                conn.rollback()  # The failed INSERT opened a transaction; don't return it to the pool holding the lock
+                return False
+            conn.commit()
+            return True
+
+    def best_score(self, username):
+        with self.connection() as conn:
+            row = conn.execute('SELECT best_score FROM users WHERE username = ?', (username,)).fetchone()
+            return row[0] if row else None
+
+    def score_server(self):
+        # With a score server the ranking is read from its cache, which also has scores not yet committed
+        if SCORE_SERVER and self.score_client is None:
+            try:
+                self.score_client = ScoreClient(SCORE_SERVER, fall_back=False)  # Only the game writes scores
+            except OSError as e:
+                print(f"Failed to connect to score server at {SCORE_SERVER}: {e}")
+                self.score_client = False
+        if self.score_client and self.score_client.connected:
+            return self.score_client
+        return None
+
+    def leaderboard(self, limit=100, after=None):
+        # Keyset pagination over users_by_best_score: `after` is the (best_score, username) cursor
+        # returned with the previous page, so every page is an index seek instead of an OFFSET scan
+        server = self.score_server()
+        if server:
+            try:
+                return server.leaderboard(limit, after)
+            except OSError as e:
+                print(f"Failed to load leaderboard from score server: {e}")
+        with self.connection() as conn:
+            if after is None:
+                rows = conn.execute('SELECT username, best_score FROM users ORDER BY best_score DESC, username LIMIT ?',
+                                    (limit,)).fetchall()
+            else:
+                rows = conn.execute('SELECT username, best_score FROM users WHERE best_score = ? AND username > ? '
+                                    'ORDER BY username LIMIT ?', (after[0], after[1], limit)).fetchall()
+                if len(rows) < limit:
+                    rows += conn.execute('SELECT username, best_score FROM users WHERE best_score < ? '
+                                         'ORDER BY best_score DESC, username LIMIT ?',
+                                         (after[0], limit - len(rows))).fetchall()
+        next_cursor = (rows[-1][1], rows[-1][0]) if len(rows) == limit else None
+        return rows, next_cursor
+
+    def rank(self, username):
+        # Rank is 1 + the number of users with a strictly higher best score (ties share a rank)
+        server = self.score_server()
+        if server:
+            try:
+                return server.rank(username)
+            except OSError as e:
+                print(f"Failed to load user rank from score server: {e}")
+        with self.connection() as conn:
+            row = conn.execute('SELECT IFNULL(best_score, 0) FROM users WHERE username = ?', (username,)).fetchone()
+            if row is None:
+                return None
+            return conn.execute('SELECT IFNULL(SUM(users), 0) + 1 FROM score_counts WHERE score > ?',
+                                (row[0],)).fetchone()[0]
+
+    def recent_games(self, username, limit=50, before=None):
+        # Newest first; pass the returned cursor as `before` to get the next page
+        with self.connection() as conn:
+            if before is None:
+                rows = conn.execute('SELECT id, score, won, played_at FROM games WHERE username = ? '
+                                    'ORDER BY id DESC LIMIT ?', (username, limit)).fetchall()
+            else:
+                rows = conn.execute('SELECT id, score, won, played_at FROM games WHERE username = ? AND id < ? '
+                                    'ORDER BY id DESC LIMIT ?', (username, before, limit)).fetchall()
+        next_cursor = rows[-1][0] if len(rows) == limit else None
+        return rows, next_cursor
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+        if self.score_client:
+            self.score_client.close()
+
+
+account_store = None
+
+
+def get_account_store():
+    global account_store
+    if account_store is None:
+        account_store = AccountStore(DATABASE_FILE)
+        atexit.register(account_store.close)
+    return account_store
+
+
+def check_credentials(username, password):
+    return get_account_store().verify(username, password)
+
+
+class AccountTask(QRunnable):
+    def __init__(self, service, description, function, args, callback):
+        super().__init__()
+        self.service = service
+        self.description = description
+        self.function = function
+        self.args = args
+        self.callback = callback
+
+    def run(self):
+        try:
+            result = self.function(*self.args)
+        except Exception as e:
+            self.service.failed.emit(self.callback, self.description, str(e))
+            return
+        self.service.finished.emit(self.callback, result)
+
+
+class AccountService(QObject):
+    # Runs AccountStore calls on a thread pool so slow disks, a database locked by the game's
+    # writes or expensive password hashes never block the dialogs. Each call's callback runs on
+    # the GUI thread with the result, or with None after printing the error.
+    finished = pyqtSignal(object, object)
+    failed = pyqtSignal(object, str, str)
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(store.size)
+        self.finished.connect(self.deliver)
+        self.failed.connect(self.report)
+
+    def submit(self, description, function, args, callback):
+        self.pool.start(AccountTask(self, description, function, args, callback))
+
+    def deliver(self, callback, result):
+        callback(result)
+
+    def report(self, callback, description, message):
+        print(f"Failed to {description}: {message}")
+        callback(None)
+
+
+def reportStartup(event, seconds, **details):
+    print(f"Startup: {event.replace('_', ' ')} after {seconds * 1000:.0f} ms")
+    try:
+        with open(STARTUP_REPORT, "a") as f:
+            f.write(json.dumps(dict(event=event, seconds=seconds, at=time.time(), **details)) + "\n")
+    except OSError as e:
+        print(f"Failed to write startup report: {e}")
+
+
 class MyApp(QObject):
     score_updated = pyqtSignal(int)  # Signal to update the score
 
     def __init__(self):
         super().__init__()
+        self.app_time = time.time()
         self.app = QApplication(sys.argv)
         self.user_score = 0
         self.best_score = 0  # Initialize best score
         self.username = None  # Username
+        self.game_process = None
+        self.game_channel = None
+        self.game_go = None  # Set to let a warmed-up game process start playing
+        self.play_time = None  # When Play was pressed, for the startup report
+        self.game_warm = False
+        self.games_started = 0
+        self.accounts = AccountService(get_account_store())
 
         self.score_updated.connect(self.update_score_display)
+        self.game_timer = QTimer()
+        self.game_timer.timeout.connect(self.poll_game)
 
         self.open_login_dialog()  # Open login dialog
 
     def open_login_dialog(self):
         self.login_dialog = LoginDialog(self)
         self.login_dialog.show()
+        if STARTUP_REPORT:
+            # Runs once the event loop has put the window on screen
+            QTimer.singleShot(0, lambda: reportStartup("login_window", time.time() - launch_time,
+                                                       imports=self.app_time - launch_time))
 
     def open_menu_dialog(self):
-        self.load_user_data(self.username)  # Load user data, including best score
         self.menu_dialog = MenuDialog(self, self.username, self.best_score)
         self.menu_dialog.show()
+        self.load_user_data(self.username)  # Best score shows up once it is loaded
+        if WARM_UP:
+            QTimer.singleShot(0, self.warm_up)
+
+    def spawn_game(self, warm):
+        context = multiprocessing.get_context("spawn")
+        self.game_channel = GameChannel(context.RawArray('d', GameChannel.size))
+        self.game_go = context.Event() if warm else None
+        self.game_process = context.Process(target=runGame,
+                                            args=(self.game_channel.shared, self.username, self.game_go), daemon=True)
+        self.game_process.start()
+
+    def warm_up(self):
+        # Starts the next game process in the background; it imports, loads the map and the assets
+        # and then waits for Play, so pressing Play only has to open the window
+        if self.game_process is None:
+            self.spawn_game(warm=True)
 
     def start_game(self):
-        # Start the game in a new thread
-        pygame_thread = threading.Thread(target=startGame, args=(self.score_updated, self.username))
-        pygame_thread.start()
+        # The game runs in its own process and reports back through shared memory,
+        # which is polled here at most SCORE_UPDATES_PER_SECOND times per second
+        pressed = time.time()
+        if self.game_go is not None and not self.game_go.is_set() and self.game_process.is_alive():
+            self.game_go.set()  # A warmed-up process is waiting for Play
+            self.game_warm = True
+        elif self.game_process is not None and self.game_process.is_alive():
+            return  # Already playing
+        else:
+            self.spawn_game(warm=False)
+            self.game_warm = False
+        self.play_time = pressed
+        self.games_started += 1
+        self.game_timer.start(1000 // SCORE_UPDATES_PER_SECOND)
+
+    def poll_game(self):
+        status = self.game_channel.read()
+        score = status["score"]
+        if score != self.user_score:
+            self.score_updated.emit(score)
+        if hasattr(self, 'menu_dialog'):
+            self.menu_dialog.update_status(status)
+        if STARTUP_REPORT and self.play_time is not None:
+            first_frame = self.game_channel.first_frame()
+            if first_frame:
+                reportStartup("first_game_frame", first_frame - self.play_time, warm=self.game_warm,
+                              game=self.games_started)
+                self.play_time = None
+        if not self.game_process.is_alive():
+            self.game_timer.stop()
+            self.game_process.join()
+            self.game_process = None
+            self.game_go = None
+            if hasattr(self, 'menu_dialog'):
+                self.menu_dialog.load_leaderboard()
+                if WARM_UP:
+                    self.warm_up()
 
     def update_score_display(self, score):
         self.user_score = score
@@ -66,60 +432,45 @@ class MyApp(QObject):
             self.menu_dialog.update_score(score, self.best_score)  # Pass current and best score
 
     def load_user_data(self, username):
-        try:
-            conn = sqlite3.connect(DATABASE_FILE)
-            cursor = conn.cursor()
-            cursor.execute('SELECT best_score FROM users WHERE username = ?', (username,))
-            result = cursor.fetchone()
-            if result:
-                self.best_score = result[0]  # Load best score
-            conn.close()
-        except Exception as e:
-            print(f"Failed to load user data: {e}")
+        self.accounts.submit("load user data", self.accounts.store.best_score, (username,), self.user_data_loaded)
 
-    def update_user_score(self, username, new_score):
-        try:
-            conn = sqlite3.connect(DATABASE_FILE)
-            cursor = conn.cursor()
-            cursor.execute('UPDATE users SET best_score = ? WHERE username = ?', (new_score, username))
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            print(f"Failed to update user score: {e}")
+    def user_data_loaded(self, best_score):
+        if best_score is None:
+            return
+        self.best_score = max(self.best_score, best_score)  # Load best score
+        if hasattr(self, 'menu_dialog'):
+            self.menu_dialog.update_score(self.user_score, self.best_score)
 
     def register_user(self, username, password):
-        try:
-            conn = sqlite3.connect(DATABASE_FILE)
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
-            if cursor.fetchone():
-                QMessageBox.warning(None, "Registration Failed", "Username already exists.")
-                return
+        self.accounts.submit("register user", self.accounts.store.register, (username, password),
+                             lambda registered: self.user_registered(username, registered))
 
-            cursor.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, password))
+    def user_registered(self, username, registered):
+        # The register dialog stays open until here: with no window left Qt would quit the app
+        register_dialog = self.login_dialog.register_dialog
+        if registered:
             self.username = username
-            conn.commit()
-            conn.close()
             self.open_menu_dialog()  # Open menu after registration
-        except Exception as e:
-            print(f"Failed to register user: {e}")
+        else:
+            if registered is not None:
+                QMessageBox.warning(None, "Registration Failed", "Username already exists.")
+            self.login_dialog.show()  # Back to login after a failed registration
+        register_dialog.close()
 
     def login_user(self, username, password):
-        try:
-            conn = sqlite3.connect(DATABASE_FILE)
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM users WHERE username = ? AND password = ?', (username, password))
-            user = cursor.fetchone()
-            if user:
-                self.username = username
-                QMessageBox.information(None, "Login Successful", "You have successfully logged in.")
-                self.open_menu_dialog()  # Open menu after successful login
-                self.login_dialog.close()  # Close the login dialog
-            else:
-                QMessageBox.warning(None, "Login Failed", "Invalid username or password.")
-            conn.close()
-        except Exception as e:
-            print(f"Failed to login user: {e}")
+        self.login_dialog.login_button.setEnabled(False)  # One check at a time
+        self.accounts.submit("login user", self.accounts.store.verify, (username, password),
+                             lambda valid: self.user_logged_in(username, valid))
+
+    def user_logged_in(self, username, valid):
+        self.login_dialog.login_button.setEnabled(True)
+        if valid:
+            self.username = username
+            QMessageBox.information(None, "Login Successful", "You have successfully logged in.")
+            self.open_menu_dialog()  # Open menu after successful login
+            self.login_dialog.close()  # Close the login dialog
+        elif valid is not None:
+            QMessageBox.warning(None, "Login Failed", "Invalid username or password.")
 
 
 class LoginDialog(QDialog):
@@ -181,8 +532,8 @@ class RegisterDialog(QDialog):
     def register(self):
         username = self.username_input.text()
         password = self.password_input.text()
+        self.register_button.setEnabled(False)  # Closed once the registration is done
         self.app.register_user(username, password)
-        self.close()
 
 
 class MenuDialog(QDialog):
@@ -191,7 +542,7 @@ class MenuDialog(QDialog):
         self.app = app
         self.username = username
         self.setWindowTitle("Menu")
-        self.setGeometry(100, 100, 300, 300)
+        self.setGeometry(100, 100, 300, 500)
 
         layout = QFormLayout()
 
@@ -205,6 +556,21 @@ class MenuDialog(QDialog):
         self.best_score_display.display(best_score)  # Display best score
         layout.addRow("Best Score:", self.best_score_display)
 
+        self.rank_label = QLabel(self)
+        layout.addRow("Your Rank:", self.rank_label)
+
+        self.status_label = QLabel("-", self)  # State and timing of the running game
+        layout.addRow("Game:", self.status_label)
+
+        self.leaderboard = QListWidget(self)
+        layout.addRow(self.leaderboard)
+
+        self.refresh_button = QPushButton("Refresh")
+        self.refresh_button.clicked.connect(self.load_leaderboard)
+        self.more_button = QPushButton("More")
+        self.more_button.clicked.connect(self.load_more_leaderboard)
+        layout.addRow(self.refresh_button, self.more_button)
+
         self.play_button = QPushButton("Play")
         self.play_button.clicked.connect(self.start_game)
         layout.addRow(self.play_button)
@@ -215,6 +581,38 @@ class MenuDialog(QDialog):
 
         self.setLayout(layout)
 
+        self.leaderboard_cursor = None
+        self.leaderboard_version = 0
+        self.load_leaderboard()
+
+    def load_leaderboard(self):
+        self.leaderboard.clear()
+        self.leaderboard_cursor = None
+        self.leaderboard_version += 1  # Pages still on their way from before a refresh are dropped
+        accounts = self.app.accounts
+        accounts.submit("load user rank", accounts.store.rank, (self.username,), self.rank_loaded)
+        self.load_more_leaderboard()
+
+    def rank_loaded(self, rank):
+        self.rank_label.setText("-" if rank is None else f"#{rank}")
+
+    def load_more_leaderboard(self):
+        if self.leaderboard_cursor is None and self.leaderboard.count() > 0:
+            return  # Already on the last page
+        self.more_button.setEnabled(False)  # Until this page arrives
+        accounts = self.app.accounts
+        version = self.leaderboard_version
+        accounts.submit("load leaderboard", accounts.store.leaderboard, (10, self.leaderboard_cursor),
+                        lambda page: self.leaderboard_loaded(page, version))
+
+    def leaderboard_loaded(self, page, version):
+        if page is None or version != self.leaderboard_version:
+            return
+        rows, self.leaderboard_cursor = page
+        for username, best_score in rows:
+            self.leaderboard.addItem(f"{self.leaderboard.count() + 1}. {username}: {best_score}")
+        self.more_button.setEnabled(self.leaderboard_cursor is not None)
+
     def start_game(self):
         self.app.start_game()
 
@@ -222,392 +620,2647 @@ class MenuDialog(QDialog):
         self.score_display.display(score)  # Update current score display
         self.best_score_display.display(best_score)  # Update best score display
 
+    def update_status(self, status):
+        self.status_label.setText(f"{status['state']}, tick {status['ticks']}, {status['frame_ms']:.1f} ms/frame")
+
     def close_application(self):
         reply = QMessageBox.question(self, 'Exit', 'Are you sure you want to exit?',
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
                                      QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
             self.close()
-            pygame.quit()
 
 
-def startGame(score_signal, username):
-    black = (0, 0, 0)
-    white = (255, 255, 255)
-    blue = (0, 0, 255)
-    red = (255, 0, 0)
-    yellow = (255, 255, 0)
+image_files = ["pacman.png", "Blinky.png", "Pinky.png", "Inky.png", "Clyde.png", "Trollman.png"]
+font_files = [("freesansbold.ttf", 24)]
+music_file = "pacman.mp3"
 
-    Trollicon = pygame.image.load('Trollman.png')
-    pygame.display.set_icon(Trollicon)
 
-    pygame.mixer.init()
-    pygame.mixer.music.load('pacman.mp3')
-    pygame.mixer.music.play(-1, 0.0)
-
-    class Wall(pygame.sprite.Sprite):
-        def __init__(self, x, y, width, height, color):
-            pygame.sprite.Sprite.__init__(self)
-
-            self.image = pygame.Surface([width, height])
-            self.image.fill(color)
-
-            self.rect = self.image.get_rect()
-            self.rect.top = y
-            self.rect.left = x
-
-    def setupRoomOne(all_sprites_list):
-        wall_list = pygame.sprite.RenderPlain()
-
-        walls = [[0, 0, 6, 600], [0, 0, 600, 6], [0, 600, 606, 6], [600, 0, 6, 606],
-                 [300, 0, 6, 66], [60, 60, 186, 6], [360, 60, 186, 6], [60, 120, 66, 6],
-                 [60, 120, 6, 126], [180, 120, 246, 6], [300, 120, 6, 66], [480, 120, 66, 6],
-                 [540, 120, 6, 126], [120, 180, 126, 6], [120, 180, 6, 126], [360, 180, 126, 6],
-                 [480, 180, 6, 126], [180, 240, 6, 126], [180, 360, 246, 6], [420, 240, 6, 126],
-                 [240, 240, 42, 6], [324, 240, 42, 6], [240, 240, 6, 66], [240, 300, 126, 6],
-                 [360, 240, 6, 66], [0, 300, 66, 6], [540, 300, 66, 6], [60, 360, 66, 6],
-                 [60, 360, 6, 186], [480, 360, 66, 6], [540, 360, 6, 186], [120, 420, 366, 6],
-                 [120, 420, 6, 66], [480, 420, 6, 66], [180, 480, 246, 6], [300, 480, 6, 66],
-                 [120, 540, 126, 6], [360, 540, 126, 6]]
-
-        for item in walls:
-            wall = Wall(item[0], item[1], item[2], item[3], blue)
-            wall_list.add(wall)
-            all_sprites_list.add(wall)
-
-        return wall_list
-
-    def setupGate(all_sprites_list):
-        gate = pygame.sprite.RenderPlain()
-        gate.add(Wall(282, 242, 42, 2, white))
-        all_sprites_list.add(gate)
-        return gate
-
-    class Block(pygame.sprite.Sprite):
-        def __init__(self, color, width, height):
-            pygame.sprite.Sprite.__init__(self)
-
-            self.image = pygame.Surface([width, height])
-            self.image.fill(white)
-            self.image.set_colorkey(white)
-            pygame.draw.ellipse(self.image, color, [0, 0, width, height])
-
-            self.rect = self.image.get_rect()
-
-    class Player(pygame.sprite.Sprite):
-        change_x = 0
-        change_y = 0
-
-        def __init__(self, x, y, filename):
-            pygame.sprite.Sprite.__init__(self)
-
-            self.image = pygame.image.load(filename).convert()
-
-            self.rect = self.image.get_rect()
-            self.rect.top = y
-            self.rect.left = x
-            self.prev_x = x
-            self.prev_y = y
-
-        def prevdirection(self):
-            self.prev_x = self.change_x
-            self.prev_y = self.change_y
-
-        def changespeed(self, x, y):
-            self.change_x += x
-            self.change_y += y
-
-        def update(self, walls, gate):
-            old_x = self.rect.left
-            new_x = old_x + self.change_x
-            prev_x = old_x + self.prev_x
-            self.rect.left = new_x
-
-            old_y = self.rect.top
-            new_y = old_y + self.change_y
-            prev_y = old_y + self.prev_y
-
-            x_collide = pygame.sprite.spritecollide(self, walls, False)
-            if x_collide:
-                self.rect.left = old_x
+class Assets:
+    # Every image, font, sound and generated surface is created once per process and shared by
+    # all sprites that use it. load_times records how long each file took to load.
+    def __init__(self):
+        self.images = {}
+        self.converted = set()
+        self.fonts = {}
+        self.surfaces = {}
+        self.music_file = None
+        self.load_times = {}
+
+    def image(self, filename):
+        image = self.images.get(filename)
+        if image is None:
+            start = time.perf_counter()
+            image = pygame.image.load(filename)
+            self.load_times[filename] = time.perf_counter() - start
+            self.images[filename] = image
+        if filename not in self.converted and pygame.display.get_surface() is not None:
+            # Images loaded before the window existed (or in headless runs) are converted once it does
+            start = time.perf_counter()
+            image = self.images[filename] = image.convert()
+            self.converted.add(filename)
+            self.load_times[filename] = self.load_times.get(filename, 0.0) + time.perf_counter() - start
+        return image
+
+    def font(self, filename, size):
+        key = (filename, size)
+        font = self.fonts.get(key)
+        if font is None:
+            pygame.font.init()
+            start = time.perf_counter()
+            font = self.fonts[key] = pygame.font.Font(filename, size)
+            self.load_times[f"{filename}:{size}"] = time.perf_counter() - start
+        return font
+
+    def music(self, filename):
+        # pygame streams music, so the track is only (re)loaded when it changes
+        if self.music_file == filename:
+            return True
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        start = time.perf_counter()
+        try:
+            pygame.mixer.music.load(filename)
+        except pygame.error as e:
+            print(f"Failed to load music: {e}")
+            return False
+        self.load_times[filename] = time.perf_counter() - start
+        self.music_file = filename
+        return True
+
+    def filled(self, width, height, color):
+        key = ("filled", width, height, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.surfaces[key] = pygame.Surface([width, height])
+            surface.fill(color)
+        return surface
+
+    def pellet(self, color, width, height):
+        key = ("pellet", width, height, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.surfaces[key] = pygame.Surface([width, height])
+            surface.fill(white)
+            surface.set_colorkey(white)
+            pygame.draw.ellipse(surface, color, [0, 0, width, height])
+        return surface
+
+    def preload(self):
+        for filename in image_files:
+            self.image(filename)
+        for filename, size in font_files:
+            self.font(filename, size)
+
+
+assets = Assets()
+
+
+class Wall(pygame.sprite.Sprite):
+    def __init__(self, x, y, width, height, color):
+        pygame.sprite.Sprite.__init__(self)
+
+        self.image = assets.filled(width, height, color)
+
+        self.rect = self.image.get_rect()
+        self.rect.top = y
+        self.rect.left = x
+
+
+def setupRoomOne(all_sprites_list, maze):
+    wall_list = pygame.sprite.RenderPlain()
+
+    for item in maze.walls:
+        wall = Wall(item[0], item[1], item[2], item[3], blue)
+        wall_list.add(wall)
+        all_sprites_list.add(wall)
+
+    return wall_list
+
+
+def setupGate(all_sprites_list, maze):
+    gate = pygame.sprite.RenderPlain()
+    for item in maze.gate:
+        gate.add(Wall(item[0], item[1], item[2], item[3], white))
+    all_sprites_list.add(gate)
+    return gate
+
+
+class CollisionGrid:
+    # Summed-area table over every pixel covered by the given rects, so testing whether a
+    # rect touches any of them is four lookups no matter how many rects the maze has
+    def __init__(self, rects):
+        rects = [pygame.Rect(rect) for rect in rects]
+        self.width = max((rect.right for rect in rects), default=0)
+        self.height = max((rect.bottom for rect in rects), default=0)
+        self.stride = self.width + 1
+        self.table = array('i', bytes(4 * self.stride * (self.height + 1)))
+
+        row_above = [0] * self.stride
+        for y in range(self.height):
+            occupied = bytearray(self.width)
+            for rect in rects:
+                if rect.top <= y < rect.bottom and rect.width > 0:
+                    occupied[max(rect.left, 0):rect.right] = b'\x01' * (rect.right - max(rect.left, 0))
+            row = [above + count for above, count in zip(row_above, accumulate(occupied, initial=0))]
+            self.table[(y + 1) * self.stride:(y + 2) * self.stride] = array('i', row)
+            row_above = row
+        self.sums = np.frombuffer(self.table, dtype=np.int32)  # The same table, for collides_many()
+
+    def collides(self, rect):
+        return self.collides_at(rect.left, rect.top, rect.width, rect.height)
+
+    def collides_at(self, left, top, width, height):
+        right = min(left + width, self.width)
+        bottom = min(top + height, self.height)
+        left = max(left, 0)
+        top = max(top, 0)
+        if left >= right or top >= bottom:
+            return False
+        table = self.table
+        stride = self.stride
+        return (table[bottom * stride + right] - table[top * stride + right]
+                - table[bottom * stride + left] + table[top * stride + left]) > 0
+
+    def collides_many(self, left, top, width, height):
+        # Vectorised collides() for arrays of rects; returns a boolean array
+        sums = self.sums
+        stride = self.stride
+        right = np.minimum(np.maximum(left + width, 0), self.width)
+        bottom = np.minimum(np.maximum(top + height, 0), self.height) * stride
+        left = np.minimum(np.maximum(left, 0), self.width)
+        top = np.minimum(np.maximum(top, 0), self.height) * stride
+        covered = sums[bottom + right] - sums[top + right] - sums[bottom + left] + sums[top + left]
+        return (covered > 0) & (left < right) & (top < bottom)
+
+    @classmethod
+    def from_table(cls, width, height, table):
+        # Rebuilds a grid from a table saved in a compiled map
+        grid = cls.__new__(cls)
+        grid.width = width
+        grid.height = height
+        grid.stride = width + 1
+        grid.table = table
+        grid.sums = np.frombuffer(table, dtype=np.int32)
+        return grid
+
+
+def mergeRects(rects):
+    # The union of the rects as few non-overlapping rects: the covered area is cut into bands at
+    # every rect edge, and runs spanning the same columns in consecutive bands are stacked
+    rects = [rect for rect in rects if rect[2] > 0 and rect[3] > 0]
+    xs = sorted({x for left, top, width, height in rects for x in (left, left + width)})
+    ys = sorted({y for left, top, width, height in rects for y in (top, top + height)})
+    column = {x: index for index, x in enumerate(xs)}
+    band = {y: index for index, y in enumerate(ys)}
+    covered = [bytearray(max(len(xs) - 1, 0)) for _ in range(len(ys) - 1)]
+    for left, top, width, height in rects:
+        first, last = column[left], column[left + width]
+        for row in covered[band[top]:band[top + height]]:
+            row[first:last] = b'\x01' * (last - first)
+
+    merged = []
+    growing = {}  # (left, right) -> rect still being extended downwards
+    for index, row in enumerate(covered):
+        runs = []
+        start = None
+        for x, filled in enumerate(row):
+            if filled and start is None:
+                start = x
+            elif not filled and start is not None:
+                runs.append((xs[start], xs[x]))
+                start = None
+        if start is not None:
+            runs.append((xs[start], xs[len(row)]))
+
+        for run in list(growing):
+            if run not in runs:
+                merged.append(growing.pop(run))
+        for left, right in runs:
+            if (left, right) in growing:
+                growing[(left, right)][3] += ys[index + 1] - ys[index]
             else:
-                self.rect.top = new_y
-                y_collide = pygame.sprite.spritecollide(self, walls, False)
-                if y_collide:
-                    self.rect.top = old_y
-
-            if gate != False:
-                gate_hit = pygame.sprite.spritecollide(self, gate, False)
-                if gate_hit:
-                    self.rect.left = old_x
-                    self.rect.top = old_y
-
-    class Ghost(Player):
-        def changespeed(self, list, ghost, turn, steps, l):
-            try:
-                z = list[turn][2]
-                if steps < z:
-                    self.change_x = list[turn][0]
-                    self.change_y = list[turn][1]
-                    steps += 1
-                else:
-                    if turn < l:
-                        turn += 1
-                    elif ghost == "clyde":
-                        turn = 2
-                    else:
-                        turn = 0
-                    self.change_x = list[turn][0]
-                    self.change_y = list[turn][1]
-                    steps = 0
-                return [turn, steps]
-            except IndexError:
-                return [0, 0]
-
-    Pinky_directions = [[0, -30, 4], [15, 0, 9], [0, 15, 11], [-15, 0, 23], [0, 15, 7],
-                        [15, 0, 3], [0, -15, 3], [15, 0, 19], [0, 15, 3], [15, 0, 3],
-                        [0, 15, 3], [15, 0, 3], [0, -15, 15], [-15, 0, 7], [0, 15, 3],
-                        [-15, 0, 19], [0, -15, 11], [15, 0, 9]]
-
-    Blinky_directions = [[0, -15, 4], [15, 0, 9], [0, 15, 11], [15, 0, 3], [0, 15, 7],
-                         [-15, 0, 11], [0, 15, 3], [15, 0, 15], [0, -15, 15], [15, 0, 3],
-                         [0, -15, 11], [-15, 0, 3], [0, -15, 11], [-15, 0, 3], [0, -15, 3],
-                         [-15, 0, 7], [0, -15, 3], [15, 0, 15], [0, 15, 15], [-15, 0, 3],
-                         [0, 15, 3], [-15, 0, 3], [0, -15, 7], [-15, 0, 3], [0, 15, 7],
-                         [-15, 0, 11], [0, -15, 7], [15, 0, 5]]
-
-    Inky_directions = [[30, 0, 2], [0, -15, 4], [15, 0, 10], [0, 15, 7], [15, 0, 3],
-                       [0, -15, 3], [15, 0, 3], [0, -15, 15], [-15, 0, 15], [0, 15, 3],
-                       [15, 0, 15], [0, 15, 11], [-15, 0, 3], [0, -15, 7], [-15, 0, 11],
-                       [0, 15, 3], [-15, 0, 11], [0, 15, 7], [-15, 0, 3], [0, -15, 3],
-                       [-15, 0, 3], [0, -15, 15], [15, 0, 15], [0, 15, 3], [-15, 0, 15],
-                       [0, 15, 11], [15, 0, 3], [0, -15, 11], [15, 0, 11], [0, 15, 3],
-                       [15, 0, 1]]
-
-    Clyde_directions = [[-30, 0, 2], [0, -15, 4], [15, 0, 5], [0, 15, 7], [-15, 0, 11],
-                        [0, -15, 7], [-15, 0, 3], [0, 15, 7], [-15, 0, 7], [0, 15, 15],
-                        [15, 0, 15], [0, -15, 3], [-15, 0, 11], [0, -15, 7], [15, 0, 3],
-                        [0, -15, 11], [15, 0, 9]]
-
-    pl = len(Pinky_directions) - 1
-    bl = len(Blinky_directions) - 1
-    il = len(Inky_directions) - 1
-    cl = len(Clyde_directions) - 1
-
-    screen = pygame.display.set_mode([606, 606])
-    pygame.display.set_caption('Pacman')
+                growing[(left, right)] = [left, ys[index], right - left, ys[index + 1] - ys[index]]
+    merged += growing.values()
+    return sorted(merged, key=lambda rect: (rect[1], rect[0]))
+
+
+# Map files are JSON: screen size, cell and sprite size, wall and gate rects, Pacman and ghost
+# spawn points and pellet placement. They are compiled into a Maze once and the result is cached
+# next to the map as <name>.mapc, keyed by a hash of the map file.
+map_file = os.environ.get("PACMAN_MAP", "classic.json")
+map_cache_magic = b"PMAP"
+map_version = 2
+map_cache_header = struct.Struct("<4sH32s")  # Magic, compiler version, SHA-256 of the map file
+map_cache_section = struct.Struct("<I")
+
+# Navigation grid cells, one per sprite-sized square on the cell lattice Pacman spawns on
+NAV_WALL, NAV_OPEN, NAV_GATE = range(3)
+# Neighbour order of the path tables, which is also the tie-break between equally short paths
+nav_directions = [(0, -1), (-1, 0), (0, 1), (1, 0)]
+NAV_STAY = 255  # Next-step entry for a cell and itself
+
+
+def navigationTables(nav, columns, rows):
+    # All-pairs shortest paths between the cells a ghost can stand on (open or gate), found by a
+    # breadth-first search from every cell at once. Cells get compact indices; returns:
+    #   index     lattice cell (row * columns + column) -> compact index, or -1 for walls
+    #   lattice   compact index -> (column, row)
+    #   neighbors compact index -> compact index of each nav_directions neighbour, or count if blocked
+    #   distance  [from, to] -> steps, or 65535 when unreachable
+    #   next      [from, to] -> nav_directions index of the first step, NAV_STAY when from == to
+    #   nearest   lattice cell -> compact index of the closest walkable cell, for targets in walls
+    grid = np.frombuffer(bytes(nav), dtype=np.uint8).reshape(rows, columns)
+    lattice = np.argwhere(grid != NAV_WALL)[:, ::-1].astype(np.int32)
+    count = len(lattice)
+    index = np.full(rows * columns, -1, dtype=np.int32)
+    index[lattice[:, 1] * columns + lattice[:, 0]] = np.arange(count, dtype=np.int32)
+
+    neighbors = np.full((count, len(nav_directions)), count, dtype=np.int32)
+    for direction, (dx, dy) in enumerate(nav_directions):
+        x = lattice[:, 0] + dx
+        y = lattice[:, 1] + dy
+        inside = (x >= 0) & (x < columns) & (y >= 0) & (y < rows)
+        found = np.where(inside, index[np.where(inside, y * columns + x, 0)], -1)
+        neighbors[:, direction] = np.where(found >= 0, found, count)
+
+    # reached[cell, target] grows one step per pass; the extra row stands in for blocked neighbours
+    distance = np.full((count, count), 65535, dtype=np.uint16)
+    reached = np.zeros((count + 1, count), dtype=bool)
+    reached[np.arange(count), np.arange(count)] = True
+    distance[reached[:count]] = 0
+    steps = 0
+    while True:
+        steps += 1
+        grown = reached[neighbors[:, 0]]
+        for direction in range(1, len(nav_directions)):
+            grown |= reached[neighbors[:, direction]]
+        grown &= ~reached[:count]
+        if not grown.any():
+            break
+        distance[grown] = steps
+        reached[:count] |= grown
+
+    next_step = np.full((count, count), NAV_STAY, dtype=np.uint8)
+    padded = np.vstack([distance, np.full((1, count), 65535, dtype=np.uint16)]).astype(np.int32)
+    for direction in reversed(range(len(nav_directions))):
+        closer = padded[neighbors[:, direction]] == padded[:count] - 1
+        next_step[closer] = direction
+
+    nearest = index.copy()
+    queue_cells = deque(np.flatnonzero(index >= 0).tolist())
+    while queue_cells:
+        cell = queue_cells.popleft()
+        row, column = divmod(cell, columns)
+        for dx, dy in nav_directions:
+            x, y = column + dx, row + dy
+            if 0 <= x < columns and 0 <= y < rows and nearest[y * columns + x] < 0:
+                nearest[y * columns + x] = nearest[cell]
+                queue_cells.append(y * columns + x)
+
+    return {"index": index, "lattice": lattice, "neighbors": neighbors, "distance": distance,
+            "next": next_step, "nearest": nearest}
+
+
+# dtype and columns of each path table in cache order: 0 for flat tables, -1 for [from, to] tables
+path_table_layout = [("index", np.int32, 0), ("lattice", np.int32, 2), ("neighbors", np.int32, len(nav_directions)),
+                     ("distance", np.uint16, -1), ("next", np.uint8, -1), ("nearest", np.int32, 0)]
+
+
+class Maze:
+    # A compiled map: merged wall rects, gate, spawn points, pellet cells, navigation grid and
+    # the collision grids, i.e. everything a round needs that only depends on the map file
+    def __init__(self, info, walls, gate, pellets, nav, wall_grid, gate_grid, paths):
+        self.info = info
+        self.name = info["name"]
+        self.size = info["size"]
+        self.cell = info["cell"]
+        self.sprite = info["sprite"]
+        self.pacman = info["pacman"]
+        self.ghosts = info["ghosts"]  # Ghost name -> spawn point
+        self.pellet_offset = info["pellet_offset"]
+        self.pellet_size = info["pellet_size"]
+        self.nav_origin = info["nav_origin"]
+        self.nav_columns = info["nav_columns"]
+        self.nav_rows = info["nav_rows"]
+        self.walls = walls
+        self.gate = gate
+        self.pellets = pellets  # (row, column) cells that get a pellet
+        self.nav = nav  # Row-major NAV_* bytes
+        self.wall_grid = wall_grid
+        self.gate_grid = gate_grid
+        self.paths = paths  # navigationTables() for the nav grid
+        self.digest = bytes(32)  # SHA-256 of the map file, set by load_map()
+
+    def nav_cell(self, x, y):
+        # (column, row) of the navigation cell a sprite at (x, y) is in
+        return ((x - self.nav_origin[0]) // self.cell, (y - self.nav_origin[1]) // self.cell)
+
+    def to_bytes(self, digest):
+        flat = lambda rows: array('i', [value for row in rows for value in row]).tobytes()
+        info = dict(self.info, grid_size=[self.wall_grid.width, self.wall_grid.height],
+                    gate_grid_size=[self.gate_grid.width, self.gate_grid.height])
+        sections = [json.dumps(info).encode(), flat(self.walls), flat(self.gate), flat(self.pellets),
+                    bytes(self.nav), self.wall_grid.table.tobytes(), self.gate_grid.table.tobytes()]
+        sections += [self.paths[name].tobytes() for name, dtype, columns in path_table_layout]
+        data = bytearray(map_cache_header.pack(map_cache_magic, map_version, digest))
+        for section in sections:
+            data += map_cache_section.pack(len(section)) + section
+        return bytes(data)
+
+    @classmethod
+    def from_bytes(cls, data, digest):
+        # Returns None when the data is not a cache of this exact map file and compiler version
+        if len(data) < map_cache_header.size:
+            return None
+        magic, version, cached_digest = map_cache_header.unpack_from(data)
+        if magic != map_cache_magic or version != map_version or cached_digest != digest:
+            return None
+        sections = []
+        offset = map_cache_header.size
+        while offset < len(data):
+            length, = map_cache_section.unpack_from(data, offset)
+            offset += map_cache_section.size
+            sections.append(data[offset:offset + length])
+            offset += length
+        info_bytes, walls, gate, pellets, nav, wall_table, gate_table = sections[:7]
+        info = json.loads(info_bytes)
+        paths = {}
+        for (name, dtype, columns), raw in zip(path_table_layout, sections[7:]):
+            table = np.frombuffer(raw, dtype=dtype).copy()
+            if columns:
+                table = table.reshape(-1, columns if columns > 0 else len(paths["lattice"]))
+            paths[name] = table
+        grid_size = info.pop("grid_size")
+        gate_grid_size = info.pop("gate_grid_size")
+        unflat = lambda raw, width: [list(values) for values in zip(*[iter(array('i', raw))] * width)]
+        return cls(info, unflat(walls, 4), unflat(gate, 4), [tuple(cell) for cell in unflat(pellets, 2)],
+                   bytearray(nav), CollisionGrid.from_table(*grid_size, array('i', wall_table)),
+                   CollisionGrid.from_table(*gate_grid_size, array('i', gate_table)), paths)
+
+
+def compileMap(source):
+    # Builds a Maze from a parsed map file
+    size = source.get("size", [606, 606])
+    cell = source.get("cell", 30)
+    sprite = source.get("sprite", 32)
+    walls = mergeRects(source["walls"])
+    gate = [list(rect) for rect in source.get("gate", [])]
+    wall_grid = CollisionGrid(walls)
+    gate_grid = CollisionGrid(gate)
+    pacman = list(source["pacman"])
+    ghosts = {name: list(spawn) for name, spawn in source["ghosts"].items()}
+
+    # Pellets sit on the cell lattice wherever they miss the walls and Pacman's start
+    pellet_source = source.get("pellets", {})
+    pellet_offset = pellet_source.get("offset", 32)
+    pellet_size = pellet_source.get("size", 4)
+    skip = {tuple(cell_position) for cell_position in pellet_source.get("skip", [])}
+    start_rect = pygame.Rect(pacman[0], pacman[1], sprite, sprite)
+    pellets = []
+    for row in range((size[1] - pellet_offset - pellet_size) // cell + 1):
+        for column in range((size[0] - pellet_offset - pellet_size) // cell + 1):
+            if (row, column) in skip:
+                continue
+            rect = pygame.Rect(cell * column + pellet_offset, cell * row + pellet_offset, pellet_size, pellet_size)
+            if wall_grid.collides(rect) or rect.colliderect(start_rect):
+                continue
+            pellets.append((row, column))
+
+    nav_origin = [pacman[0] % cell, pacman[1] % cell]
+    nav_columns = (size[0] - nav_origin[0] - sprite) // cell + 1
+    nav_rows = (size[1] - nav_origin[1] - sprite) // cell + 1
+    nav = bytearray(nav_columns * nav_rows)
+    for row in range(nav_rows):
+        for column in range(nav_columns):
+            rect = pygame.Rect(nav_origin[0] + cell * column, nav_origin[1] + cell * row, sprite, sprite)
+            if not wall_grid.collides(rect):
+                nav[row * nav_columns + column] = NAV_GATE if gate_grid.collides(rect) else NAV_OPEN
+
+    info = {"name": source.get("name", ""), "size": size, "cell": cell, "sprite": sprite, "pacman": pacman,
+            "ghosts": ghosts, "pellet_offset": pellet_offset, "pellet_size": pellet_size,
+            "nav_origin": nav_origin, "nav_columns": nav_columns, "nav_rows": nav_rows}
+    paths = navigationTables(nav, nav_columns, nav_rows)
+    return Maze(info, walls, gate, pellets, nav, wall_grid, gate_grid, paths)
+
+
+mazes = {}
+
+
+def load_map(path=None):
+    # Compiled maps are shared by every round in the process and cached on disk between runs
+    path = path or map_file
+    maze = mazes.get(path)
+    if maze is not None:
+        return maze
+
+    with open(path, "rb") as f:
+        source = f.read()
+    digest = hashlib.sha256(source).digest()
+    cache_path = os.path.splitext(path)[0] + ".mapc"
+    try:
+        with open(cache_path, "rb") as f:
+            maze = Maze.from_bytes(f.read(), digest)
+    except (OSError, ValueError, struct.error) as e:
+        if not isinstance(e, FileNotFoundError):
+            print(f"Failed to read map cache: {e}")
+        maze = None
+
+    if maze is None:
+        maze = compileMap(json.loads(source))
+        try:
+            with open(cache_path + ".tmp", "wb") as f:
+                f.write(maze.to_bytes(digest))
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError as e:
+            print(f"Failed to write map cache: {e}")
 
-    background = pygame.Surface(screen.get_size())
-    background = background.convert()
-    background.fill(black)
+    maze.digest = digest
+    mazes[path] = maze
+    return maze
 
-    clock = pygame.time.Clock()
-    pygame.font.init()
-    font = pygame.font.Font("freesansbold.ttf", 24)
 
-    w = 303 - 16
-    p_h = (7 * 60) + 19
-    m_h = (4 * 60) + 19
-    b_h = (3 * 60) + 19
-    i_w = 303 - 16 - 32
-    c_w = 303 + (32 - 16)
+class TextCache:
+    # Rendered text surfaces keyed by (text, color, font); the least recently used is evicted first
+    def __init__(self, size=64):
+        self.size = size
+        self.surfaces = OrderedDict()
 
-    def startGame():
-        all_sprites_list = pygame.sprite.RenderPlain()
-        block_list = pygame.sprite.RenderPlain()
-        monsta_list = pygame.sprite.RenderPlain()
-        pacman_collide = pygame.sprite.RenderPlain()
+    def render(self, font, text, color):
+        key = (text, color, font)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = font.render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
 
-        wall_list = setupRoomOne(all_sprites_list)
-        gate = setupGate(all_sprites_list)
 
-        p_turn = 0
-        p_steps = 0
+text_cache = TextCache()
 
-        b_turn = 0
-        b_steps = 0
 
-        i_turn = 0
-        i_steps = 0
+class Block(pygame.sprite.Sprite):
+    def __init__(self, color, width, height):
+        pygame.sprite.Sprite.__init__(self)
 
-        c_turn = 0
-        c_steps = 0
+        self.image = assets.pellet(color, width, height)
 
-        Pacman = Player(w, p_h, "pacman.png")
-        all_sprites_list.add(Pacman)
-        pacman_collide.add(Pacman)
+        self.rect = self.image.get_rect()
 
-        Blinky = Ghost(w, b_h, "Blinky.png")
-        monsta_list.add(Blinky)
-        all_sprites_list.add(Blinky)
 
-        Pinky = Ghost(w, m_h, "Pinky.png")
-        monsta_list.add(Pinky)
-        all_sprites_list.add(Pinky)
+class Player(pygame.sprite.Sprite):
+    change_x = 0
+    change_y = 0
 
-        Inky = Ghost(i_w, m_h, "Inky.png")
-        monsta_list.add(Inky)
-        all_sprites_list.add(Inky)
+    def __init__(self, x, y, filename):
+        pygame.sprite.Sprite.__init__(self)
 
-        Clyde = Ghost(c_w, m_h, "Clyde.png")
-        monsta_list.add(Clyde)
-        all_sprites_list.add(Clyde)
+        self.image = assets.image(filename)
 
-        for row in range(19):
-            for column in range(19):
-                if (row == 7 or row == 8) and (column == 8 or column == 9 or column == 10):
-                    continue
-                else:
-                    block = Block(yellow, 4, 4)
+        self.rect = self.image.get_rect()
+        self.rect.top = y
+        self.rect.left = x
 
-                    block.rect.x = (30 * column + 6) + 26
-                    block.rect.y = (30 * row + 6) + 26
+    def changespeed(self, x, y):
+        self.change_x += x
+        self.change_y += y
 
-                    b_collide = pygame.sprite.spritecollide(block, wall_list, False)
-                    p_collide = pygame.sprite.spritecollide(block, pacman_collide, False)
-                    if b_collide:
-                        continue
-                    elif p_collide:
-                        continue
-                    else:
-                        block_list.add(block)
-                        all_sprites_list.add(block)
+    def update(self, walls, gate):
+        old_x = self.rect.left
+        new_x = old_x + self.change_x
+        self.rect.left = new_x
 
-        bll = len(block_list)
-        score = 0
-        done = False
+        old_y = self.rect.top
+        new_y = old_y + self.change_y
 
-        while not done:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    done = True
+        x_collide = walls.collides(self.rect)
+        if x_collide:
+            self.rect.left = old_x
+        else:
+            self.rect.top = new_y
+            y_collide = walls.collides(self.rect)
+            if y_collide:
+                self.rect.top = old_y
 
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_LEFT or event.key == pygame.K_a:
-                        Pacman.changespeed(-30, 0)
-                    if event.key == pygame.K_RIGHT or event.key == pygame.K_d:
-                        Pacman.changespeed(30, 0)
-                    if event.key == pygame.K_UP or event.key == pygame.K_w:
-                        Pacman.changespeed(0, -30)
-                    if event.key == pygame.K_DOWN or event.key == pygame.K_s:
-                        Pacman.changespeed(0, 30)
-
-                if event.type == pygame.KEYUP:
-                    if event.key == pygame.K_LEFT or event.key == pygame.K_a:
-                        Pacman.changespeed(30, 0)
-                    if event.key == pygame.K_RIGHT or event.key == pygame.K_d:
-                        Pacman.changespeed(-30, 0)
-                    if event.key == pygame.K_UP or event.key == pygame.K_w:
-                        Pacman.changespeed(0, 30)
-                    if event.key == pygame.K_DOWN or event.key == pygame.K_s:
-                        Pacman.changespeed(0, -30)
-
-            Pacman.update(wall_list, gate)
-
-            returned = Pinky.changespeed(Pinky_directions, False, p_turn, p_steps, pl)
-            p_turn = returned[0]
-            p_steps = returned[1]
-            Pinky.changespeed(Pinky_directions, False, p_turn, p_steps, pl)
-            Pinky.update(wall_list, False)
-
-            returned = Blinky.changespeed(Blinky_directions, False, b_turn, b_steps, bl)
-            b_turn = returned[0]
-            b_steps = returned[1]
-            Blinky.changespeed(Blinky_directions, False, b_turn, b_steps, bl)
-            Blinky.update(wall_list, False)
-
-            returned = Inky.changespeed(Inky_directions, False, i_turn, i_steps, il)
-            i_turn = returned[0]
-            i_steps = returned[1]
-            Inky.changespeed(Inky_directions, False, i_turn, i_steps, il)
-            Inky.update(wall_list, False)
-
-            returned = Clyde.changespeed(Clyde_directions, "clyde", c_turn, c_steps, cl)
-            c_turn = returned[0]
-            c_steps = returned[1]
-            Clyde.changespeed(Clyde_directions, "clyde", c_turn, c_steps, cl)
-            Clyde.update(wall_list, False)
-
-            blocks_hit_list = pygame.sprite.spritecollide(Pacman, block_list, True)
-
-            if len(blocks_hit_list) > 0:
-                score += len(blocks_hit_list)
-                score_signal.emit(score)
-                update_user_score(username, score)
-
-            screen.fill(black)
-
-            wall_list.draw(screen)
-            gate.draw(screen)
-            all_sprites_list.draw(screen)
-            monsta_list.draw(screen)
-
-            text = font.render("Score: " + str(score) + "/" + str(bll), True, red)
-            screen.blit(text, [10, 10])
-
-            if score == bll:
-                doNext("Congratulations, you won!", 145, all_sprites_list, block_list, monsta_list, pacman_collide,
-                       wall_list, gate)
-                update_user_score(username, score)
-
-            monsta_hit_list = pygame.sprite.spritecollide(Pacman, monsta_list, False)
-
-            if monsta_hit_list:
-                doNext("Game Over", 235, all_sprites_list, block_list, monsta_list, pacman_collide, wall_list, gate)
+        if gate != False:
+            gate_hit = gate.collides(self.rect)
+            if gate_hit:
+                self.rect.left = old_x
+                self.rect.top = old_y
+
+
+class Ghost(Player):
+    # Ghost sprites are only drawn; their movement is done in bulk by GhostEngine
+    pass
+
+
+Pinky_directions = [[0, -30, 4], [15, 0, 9], [0, 15, 11], [-15, 0, 23], [0, 15, 7],
+                    [15, 0, 3], [0, -15, 3], [15, 0, 19], [0, 15, 3], [15, 0, 3],
+                    [0, 15, 3], [15, 0, 3], [0, -15, 15], [-15, 0, 7], [0, 15, 3],
+                    [-15, 0, 19], [0, -15, 11], [15, 0, 9]]
+
+Blinky_directions = [[0, -15, 4], [15, 0, 9], [0, 15, 11], [15, 0, 3], [0, 15, 7],
+                     [-15, 0, 11], [0, 15, 3], [15, 0, 15], [0, -15, 15], [15, 0, 3],
+                     [0, -15, 11], [-15, 0, 3], [0, -15, 11], [-15, 0, 3], [0, -15, 3],
+                     [-15, 0, 7], [0, -15, 3], [15, 0, 15], [0, 15, 15], [-15, 0, 3],
+                     [0, 15, 3], [-15, 0, 3], [0, -15, 7], [-15, 0, 3], [0, 15, 7],
+                     [-15, 0, 11], [0, -15, 7], [15, 0, 5]]
+
+Inky_directions = [[30, 0, 2], [0, -15, 4], [15, 0, 10], [0, 15, 7], [15, 0, 3],
+                   [0, -15, 3], [15, 0, 3], [0, -15, 15], [-15, 0, 15], [0, 15, 3],
+                   [15, 0, 15], [0, 15, 11], [-15, 0, 3], [0, -15, 7], [-15, 0, 11],
+                   [0, 15, 3], [-15, 0, 11], [0, 15, 7], [-15, 0, 3], [0, -15, 3],
+                   [-15, 0, 3], [0, -15, 15], [15, 0, 15], [0, 15, 3], [-15, 0, 15],
+                   [0, 15, 11], [15, 0, 3], [0, -15, 11], [15, 0, 11], [0, 15, 3],
+                   [15, 0, 1]]
+
+Clyde_directions = [[-30, 0, 2], [0, -15, 4], [15, 0, 5], [0, 15, 7], [-15, 0, 11],
+                    [0, -15, 7], [-15, 0, 3], [0, 15, 7], [-15, 0, 7], [0, 15, 15],
+                    [15, 0, 15], [0, -15, 3], [-15, 0, 11], [0, -15, 7], [15, 0, 3],
+                    [0, -15, 11], [15, 0, 9]]
+
+# Name (which picks the image and the map's spawn point), scripted route, the turn a finished
+# route loops back to and the chase targeting strategy, in drawing order
+ghost_types = [("Blinky", Blinky_directions, 0, "chase"),
+               ("Pinky", Pinky_directions, 0, "ambush"),
+               ("Inky", Inky_directions, 0, "flank"),
+               ("Clyde", Clyde_directions, 2, "shy")]
+
+ghost_count = int(os.environ.get("PACMAN_GHOSTS", "4"))  # Ghosts past the first four reuse the four types above
+ghost_release_interval = 5  # Ticks between releases of each further wave of four ghosts
+
+# "chase" ghosts hunt Pacman through the maze's path tables; "routes" replays the scripted routes
+ghost_ais = ["routes", "chase"]
+ghost_ai = "chase"
+chase_speed = 15  # Pixels a chasing ghost moves per tick; Pacman moves 30
+chase_strategies = ["chase", "ambush", "flank", "shy"]
+ambush_lead = 4  # Cells ahead of Pacman that "ambush" ghosts aim for
+flank_lead = 2  # Cells ahead of Pacman that "flank" ghosts mirror their wave's first ghost around
+shy_distance = 8  # "shy" ghosts chase while further than this many steps and otherwise retreat
+chunk_size = 256  # Side of the square world chunks sprites are drawn and updated by
+near_chunks = 2  # Chasing ghosts within this many world chunks of Pacman move every tick...
+far_update_interval = 3  # ...and the rest only every this many ticks
+scalar_ghost_limit = 12  # Up to this many ghosts a plain loop beats NumPy's per-call overhead
+
+
+class GhostEngine:
+    # All ghost state lives in NumPy arrays: positions, velocities, route cursors and step
+    # counters, with every route packed into one table. step() moves every ghost at once.
+    def __init__(self, count, maze):
+        self.grid = maze.wall_grid
+        kinds = [index % len(ghost_types) for index in range(count)]
+
+        routes = [np.array(ghost_type[1], dtype=np.int64) for ghost_type in ghost_types]
+        offsets = np.cumsum([0] + [len(route) for route in routes[:-1]])
+        self.route_table = np.concatenate(routes)
+        self.route_start = offsets[kinds]
+        self.route_last = np.array([len(routes[kind]) - 1 for kind in kinds])
+        self.route_loop = np.array([ghost_types[kind][2] for kind in kinds])
+
+        self.spawn = np.array([maze.ghosts[ghost_types[kind][0]] for kind in kinds], dtype=np.int64).reshape(count, 2)
+        self.size = np.full((count, 2), maze.sprite, dtype=np.int64)
+        self.sprite_size = (maze.sprite, maze.sprite)
+        self.release = np.arange(count) // len(ghost_types) * ghost_release_interval
+        self.released_at = int(self.release[-1]) if count else 0  # Tick from which every ghost is out
+        self.scalar = count <= scalar_ghost_limit
+        # The route table as Python lists for the per-ghost loop
+        self.route_rows = self.route_table.tolist()
+        self.routes = list(zip(self.route_start.tolist(), self.route_last.tolist(), self.route_loop.tolist(),
+                               self.release.tolist()))
+        self.reset()
+
+    def reset(self):
+        self.pos = self.spawn.copy()
+        self.vel = np.zeros_like(self.pos)
+        self.turn = np.zeros(len(self.pos), dtype=np.int64)
+        self.steps = np.zeros(len(self.pos), dtype=np.int64)
+        self.ticks = 0
+
+    cursor_columns = 2
+
+    def cursors(self):
+        # Where each ghost is along its route, as saved in snapshots
+        return np.column_stack([self.turn, self.steps])
+
+    def set_cursors(self, cursors):
+        # Raises ValueError for cursors off their ghost's route, as in a damaged snapshot
+        if np.any(cursors[:, 0] < 0) or np.any(cursors[:, 0] > self.route_last) or np.any(cursors[:, 1] < 0):
+            raise ValueError("ghost route cursor out of range")
+        self.turn = cursors[:, 0].astype(np.int64)
+        self.steps = cursors[:, 1].astype(np.int64)
+
+    def advance(self, turn, steps):
+        # Route step: keep going while the leg lasts, then move on to the next leg (or loop)
+        going = steps < self.route_table[self.route_start + turn, 2]
+        turn = np.where(going, turn, np.where(turn < self.route_last, turn + 1, self.route_loop))
+        steps = np.where(going, steps + 1, 0)
+        return turn, steps, self.route_table[self.route_start + turn, :2]
+
+    def step(self, pacman=None):
+        if self.scalar:
+            self.step_each()
+            return
+        turn, steps, _ = self.advance(self.turn, self.steps)
+        # The velocity is taken from a second look-ahead advance, as the scripted routes expect
+        _, _, vel = self.advance(turn, steps)
+        if self.ticks < self.released_at:
+            # Later waves stay in their pen until released
+            active = self.release <= self.ticks
+            turn = np.where(active, turn, self.turn)
+            steps = np.where(active, steps, self.steps)
+            vel = vel * active[:, None]
+        self.turn = turn
+        self.steps = steps
+        self.vel = vel
+        self.ticks += 1
+
+        # Same rules as Player.update without a gate: try x, and only if that is free try y
+        x, y = self.pos[:, 0], self.pos[:, 1]
+        width, height = self.size[:, 0], self.size[:, 1]
+        new_x = x + vel[:, 0]
+        x_collide = self.grid.collides_many(new_x, y, width, height)
+        new_x = np.where(x_collide, x, new_x)
+        new_y = y + vel[:, 1]
+        y_collide = x_collide | self.grid.collides_many(new_x, new_y, width, height)
+        self.pos[:, 0] = new_x
+        self.pos[:, 1] = np.where(y_collide, y, new_y)
+
+    def step_each(self):
+        # step() one ghost at a time, for the handful of ghosts of a normal game
+        rows = self.route_rows
+        collides = self.grid.collides_at
+        ticks = self.ticks
+        turns = self.turn.tolist()
+        all_steps = self.steps.tolist()
+        positions = self.pos.tolist()
+        velocities = []
+        for index, (start, last, loop, release) in enumerate(self.routes):
+            x, y = positions[index]
+            if release > ticks:
+                velocities.append((0, 0))  # Still in the pen
+                continue
+            turn = turns[index]
+            steps = all_steps[index]
+            if steps < rows[start + turn][2]:
+                steps += 1
+            else:
+                turn = turn + 1 if turn < last else loop
+                steps = 0
+            turns[index] = turn
+            all_steps[index] = steps
+            if steps < rows[start + turn][2]:
+                vel_x, vel_y = rows[start + turn][:2]
+            else:
+                vel_x, vel_y = rows[start + (turn + 1 if turn < last else loop)][:2]
+            velocities.append((vel_x, vel_y))
+
+            width, height = self.sprite_size
+            if collides(x + vel_x, y, width, height):
+                continue
+            x += vel_x
+            if not collides(x, y + vel_y, width, height):
+                y += vel_y
+            positions[index] = x, y
+        self.turn = np.array(turns, dtype=np.int64)
+        self.steps = np.array(all_steps, dtype=np.int64)
+        self.vel = np.array(velocities, dtype=np.int64).reshape(-1, 2)
+        self.pos[:] = positions
+        self.ticks += 1
+
+    def hits(self, rect):
+        if self.scalar:
+            width, height = self.sprite_size
+            left = rect.left - width
+            top = rect.top - height
+            return any(left < x < rect.right and top < y < rect.bottom for x, y in self.pos.tolist())
+        x, y = self.pos[:, 0], self.pos[:, 1]
+        return bool(np.any((x < rect.right) & (x > rect.left - self.size[:, 0])
+                           & (y < rect.bottom) & (y > rect.top - self.size[:, 1])))
+
+    def sync(self, sprites):
+        for sprite, (x, y) in zip(sprites, self.pos.tolist()):
+            sprite.rect.left = x
+            sprite.rect.top = y
+
+
+class ChaseEngine(GhostEngine):
+    # Ghosts walk from cell to cell of the maze's navigation grid. Whenever a ghost reaches a cell
+    # it picks a target cell by its type's strategy and takes the first step of the shortest path
+    # there from the map's precomputed tables, so a decision is a few array lookups for all ghosts
+    # together whatever the size of the maze.
+    def __init__(self, count, maze):
+        self.maze = maze
+        paths = maze.paths
+        self.next = paths["next"]
+        self.distance = paths["distance"]
+        self.neighbors = paths["neighbors"]
+        self.lattice = paths["lattice"]
+        self.nearest = paths["nearest"]
+        self.origin = np.array(maze.nav_origin, dtype=np.int64)
+        self.cell_positions = self.origin + self.lattice.astype(np.int64) * maze.cell
+
+        kinds = np.array([index % len(ghost_types) for index in range(count)], dtype=np.int64)
+        self.strategy = np.array([chase_strategies.index(ghost_types[kind][3]) for kind in kinds], dtype=np.int64)
+        self.leader = np.arange(count) - np.arange(count) % len(ghost_types)  # First ghost of each wave
+        self.spawn = np.array([maze.ghosts[ghost_types[kind][0]] for kind in kinds], dtype=np.int64).reshape(count, 2)
+        self.size = np.full((count, 2), maze.sprite, dtype=np.int64)
+        self.sprite_size = (maze.sprite, maze.sprite)
+        self.release = np.arange(count) // len(ghost_types) * ghost_release_interval
+        self.corner = self.lookup(0, maze.nav_rows - 1)  # Where "shy" ghosts retreat to
+        self.scalar = count <= scalar_ghost_limit
+        # The same tables as Python lists for the per-ghost loop
+        self.cell_position_rows = self.cell_positions.tolist()
+        self.lattice_rows = self.lattice.tolist()
+        self.strategy_names = [chase_strategies[strategy] for strategy in self.strategy.tolist()]
+        self.leader_list = self.leader.tolist()
+        self.reset()
+
+    def reset(self):
+        self.pos = self.spawn.copy()
+        self.vel = np.zeros_like(self.pos)
+        # Ghosts spawning between cells first move onto the nearest one
+        columns, rows = ((self.spawn - self.origin + self.maze.cell // 2) // self.maze.cell).T
+        self.cell = self.lookup(columns, rows)
+        self.goal = self.cell_positions[self.cell]
+        self.ticks = 0
+
+    cursor_columns = 1
+
+    def cursors(self):
+        # A ghost's goal is always the position of the cell it is heading for
+        return self.cell[:, None]
+
+    def set_cursors(self, cursors):
+        if np.any(cursors[:, 0] < 0) or np.any(cursors[:, 0] >= len(self.lattice)):
+            raise ValueError("ghost cell out of range")
+        self.cell = cursors[:, 0].astype(self.nearest.dtype)
+        self.goal = self.cell_positions[self.cell]
+
+    def lookup(self, columns, rows):
+        # Compact index of the walkable cell closest to each lattice cell, clamped to the grid
+        columns = np.minimum(np.maximum(columns, 0), self.maze.nav_columns - 1)
+        rows = np.minimum(np.maximum(rows, 0), self.maze.nav_rows - 1)
+        return self.nearest[rows * self.maze.nav_columns + columns]
+
+    def targets(self, pacman):
+        column, row = self.maze.nav_cell(pacman.rect.left, pacman.rect.top)
+        dx = (pacman.change_x > 0) - (pacman.change_x < 0)
+        dy = (pacman.change_y > 0) - (pacman.change_y < 0)
+        target = self.lookup(column, row)
+        ambush = self.lookup(column + ambush_lead * dx, row + ambush_lead * dy)
+        leader = self.lattice[self.cell[self.leader]]
+        flank = self.lookup(2 * (column + flank_lead * dx) - leader[:, 0], 2 * (row + flank_lead * dy) - leader[:, 1])
+        shy = np.where(self.distance[self.cell, target] > shy_distance, target, self.corner)
+        choices = np.stack([np.full(len(self.cell), target), np.full(len(self.cell), ambush), flank, shy])
+        return choices[self.strategy, np.arange(len(self.cell))]
+
+    def lookup_one(self, column, row):
+        columns = self.maze.nav_columns
+        return int(self.nearest[min(max(row, 0), self.maze.nav_rows - 1) * columns + min(max(column, 0), columns - 1)])
+
+    def targets_each(self, pacman, cells):
+        # targets() one ghost at a time, for step_each()
+        column, row = self.maze.nav_cell(pacman.rect.left, pacman.rect.top)
+        dx = (pacman.change_x > 0) - (pacman.change_x < 0)
+        dy = (pacman.change_y > 0) - (pacman.change_y < 0)
+        target = self.lookup_one(column, row)
+        ambush = self.lookup_one(column + ambush_lead * dx, row + ambush_lead * dy)
+        ahead_column = 2 * (column + flank_lead * dx)
+        ahead_row = 2 * (row + flank_lead * dy)
+        choices = []
+        for strategy, leader, cell in zip(self.strategy_names, self.leader_list, cells):
+            if strategy == "chase":
+                choices.append(target)
+            elif strategy == "ambush":
+                choices.append(ambush)
+            elif strategy == "flank":
+                leader_column, leader_row = self.lattice_rows[cells[leader]]
+                choices.append(self.lookup_one(ahead_column - leader_column, ahead_row - leader_row))
+            else:
+                choices.append(target if self.distance[cell, target] > shy_distance else int(self.corner))
+        return choices
+
+    def step(self, pacman=None):
+        if self.scalar:
+            self.step_each(pacman)
+            return
+        active = self.release <= self.ticks
+        if pacman is not None and self.ticks % far_update_interval:
+            # Ghosts far from Pacman (and so off screen) are updated less often
+            near = np.abs(self.pos // chunk_size - np.array(pacman.rect.topleft) // chunk_size).max(axis=1)
+            active &= near <= near_chunks
+        arrived = active & (self.pos == self.goal).all(axis=1)
+        if pacman is not None and arrived.any():
+            direction = self.next[self.cell, self.targets(pacman)]
+            moving = arrived & (direction != NAV_STAY)
+            self.cell = np.where(moving, self.neighbors[self.cell, np.minimum(direction, len(nav_directions) - 1)],
+                                 self.cell)
+            self.goal = self.cell_positions[self.cell]
+        # Consecutive cells are both clear of walls, so no collision test is needed on the way
+        self.vel = np.minimum(np.maximum(self.goal - self.pos, -chase_speed), chase_speed) * active[:, None]
+        self.pos += self.vel
+        self.ticks += 1
+
+    def step_each(self, pacman):
+        # step() one ghost at a time, for the handful of ghosts of a normal game
+        ticks = self.ticks
+        positions = self.pos.tolist()
+        goals = self.goal.tolist()
+        cells = self.cell.tolist()
+        far = pacman is not None and ticks % far_update_interval
+        if far:
+            pacman_column = pacman.rect.left // chunk_size
+            pacman_row = pacman.rect.top // chunk_size
+        targets = None
+        velocities = []
+        for index, release in enumerate(self.release.tolist()):
+            x, y = positions[index]
+            if release > ticks or far and max(abs(x // chunk_size - pacman_column),
+                                               abs(y // chunk_size - pacman_row)) > near_chunks:
+                velocities.append((0, 0))
+                continue
+            if pacman is not None and [x, y] == goals[index]:
+                if targets is None:
+                    targets = self.targets_each(pacman, cells)  # Before any ghost has moved on to its next cell
+                cell = cells[index]
+                direction = self.next[cell, targets[index]]
+                if direction != NAV_STAY:
+                    cell = int(self.neighbors[cell, min(direction, len(nav_directions) - 1)])
+                    cells[index] = cell
+                    goals[index] = self.cell_position_rows[cell]
+            goal_x, goal_y = goals[index]
+            vel_x = min(max(goal_x - x, -chase_speed), chase_speed)
+            vel_y = min(max(goal_y - y, -chase_speed), chase_speed)
+            velocities.append((vel_x, vel_y))
+            positions[index] = x + vel_x, y + vel_y
+        self.cell = np.array(cells, dtype=self.cell.dtype)
+        self.goal = np.array(goals, dtype=np.int64).reshape(-1, 2)
+        self.vel = np.array(velocities, dtype=np.int64).reshape(-1, 2)
+        self.pos[:] = positions
+        self.ticks += 1
+
+
+tick_rate = 10  # Game logic steps per second
+frame_rate = 60  # Render frame cap
+max_catch_up_ticks = 5  # Most ticks simulated before a frame is drawn when running behind
+
+# Key -> Pacman speed delta on KEYDOWN (KEYUP applies the opposite)
+key_directions = {
+    pygame.K_LEFT: (-30, 0), pygame.K_a: (-30, 0),
+    pygame.K_RIGHT: (30, 0), pygame.K_d: (30, 0),
+    pygame.K_UP: (0, -30), pygame.K_w: (0, -30),
+    pygame.K_DOWN: (0, 30), pygame.K_s: (0, 30),
+}
+# Pacman moves in the direction of the most recently pressed key still held and stops when none
+# is. A turn into a wall is queued and made at the first tick it is possible, for this many ticks.
+turn_buffer_ticks = 3
+steer_directions = [(0, 0), (0, -30), (-30, 0), (0, 30), (30, 0)]  # Stop, up, left, down, right
+
+
+# Snapshots: header, Pacman's rect and speed, the keys held and the queued turn, then per ghost its
+# position, velocity and route cursors (GhostEngine.cursors()), all int32, then one bit per pellet
+# of the map still on the board
+snapshot_magic = b"PMSN"
+snapshot_version = 2
+snapshot_header = struct.Struct("<4sHB8sHIII")  # Magic, version, ghost AI, map digest prefix, ghosts, pellets, ticks, score
+snapshot_pacman = struct.Struct("<iiiiI")  # Left, top, change_x, change_y, ghost engine ticks
+snapshot_input = struct.Struct("<4BBI")  # Held keys (steer_directions index, 0 = none), queued turn (255 = none) and its tick
+
+
+class GameRound:
+    # One round of play: sprites, ghost route cursors and score, without any window or audio
+    def __init__(self, ghosts=None, maze=None, ai=None, legacy_input=False):
+        self.maze = maze or load_map()
+        self.ai = ai or ghost_ai
+        # Recordings from before the input buffer replay with keys changing the speed directly
+        self.legacy_input = legacy_input
+        self.turn_buffer = turn_buffer_ticks
+        self.all_sprites_list = pygame.sprite.RenderPlain()
+        self.block_list = pygame.sprite.RenderPlain()
+        self.monsta_list = pygame.sprite.RenderPlain()
+
+        self.wall_list = setupRoomOne(self.all_sprites_list, self.maze)
+        self.gate = setupGate(self.all_sprites_list, self.maze)
+        self.wall_grid = self.maze.wall_grid
+        self.gate_grid = self.maze.gate_grid
+
+        self.Pacman = Player(self.maze.pacman[0], self.maze.pacman[1], "pacman.png")
+        self.all_sprites_list.add(self.Pacman)
+
+        engine = ChaseEngine if self.ai == "chase" else GhostEngine
+        self.ghosts = engine(ghost_count if ghosts is None else ghosts, self.maze)
+        self.ghost_sprites = []
+        for index, (x, y) in enumerate(self.ghosts.spawn.tolist()):
+            ghost = Ghost(x, y, ghost_types[index % len(ghost_types)][0] + ".png")
+            self.ghost_sprites.append(ghost)
+            self.monsta_list.add(ghost)
+            self.all_sprites_list.add(ghost)
+
+        # Pellets are created once and put back on the board by reset() for every new round
+        self.pellet_pool = {}
+        maze = self.maze
+        for row, column in maze.pellets:
+            block = Block(yellow, maze.pellet_size, maze.pellet_size)
+
+            block.rect.x = maze.cell * column + maze.pellet_offset
+            block.rect.y = maze.cell * row + maze.pellet_offset
+
+            self.pellet_pool[(row, column)] = block
+
+        self.bll = len(self.pellet_pool)
+        self.pellet_keys = list(self.pellet_pool)  # Bit order of the pellet set in snapshots
+        self.pellet_index = {key: index for index, key in enumerate(self.pellet_keys)}
+        self.pellet_mask = np.ones(self.bll, dtype=bool)  # Which of pellet_keys are still on the board
+        self.profiler = None  # FrameProfiler timing the phases of tick(), when profiling is on
+        self.recorder = None  # InputRecorder logging the keys that reach the round, when recording
+        self.reset()
+
+    def reset(self):
+        # Start a new round with the same sprites
+        x, y = self.maze.pacman
+        self.Pacman.rect.left = x
+        self.Pacman.rect.top = y
+        self.Pacman.change_x = 0
+        self.Pacman.change_y = 0
+        self.held = []  # Directions of the keys held down, most recently pressed last
+        self.queued = None  # (direction, tick, arrival time) of the turn waiting to be made
+        self.turned = []  # Arrival times of the key presses that changed Pacman's motion on the last tick
+
+        self.ghosts.reset()
+        self.ghosts.sync(self.ghost_sprites)
+
+        self.pellets = dict(self.pellet_pool)
+        self.pellet_mask[:] = True
+        self.block_list.add(*self.pellets.values())
+        self.all_sprites_list.add(*self.pellets.values())
+
+        self.score = 0
+        self.ticks = 0
+        self.eaten = []  # Pellets eaten on the last tick
+
+    def snapshot(self):
+        # The whole state of the round as bytes; restore() puts it back, on this or another round
+        # of the same map, ghost count and ghost AI
+        pacman = self.Pacman
+        ghosts = self.ghosts
+        header = snapshot_header.pack(snapshot_magic, snapshot_version, ghost_ais.index(self.ai), self.maze.digest[:8],
+                                      len(self.ghost_sprites), self.bll, self.ticks, self.score)
+        state = np.column_stack([ghosts.pos, ghosts.vel, ghosts.cursors()]).astype(np.int32)
+        bits = np.packbits(self.pellet_mask)
+        held = [steer_directions.index(direction) for direction in self.held] + [0] * (4 - len(self.held))
+        queued, queued_tick = (255, 0) if self.queued is None else (steer_directions.index(self.queued[0]), self.queued[1])
+        return b"".join([header, snapshot_pacman.pack(pacman.rect.left, pacman.rect.top, pacman.change_x,
+                                                      pacman.change_y, ghosts.ticks),
+                         snapshot_input.pack(*held, queued, queued_tick), state.tobytes(), bits.tobytes()])
+
+    def restore(self, data):
+        # Raises ValueError when the snapshot is damaged or was taken of a different kind of round
+        if len(data) < snapshot_header.size:
+            raise ValueError("snapshot is truncated")
+        magic, version, ai, digest, ghosts, pellets, ticks, score = snapshot_header.unpack_from(data)
+        if magic != snapshot_magic or version != snapshot_version:
+            raise ValueError("not a snapshot of this version")
+        if (ai >= len(ghost_ais) or ghost_ais[ai] != self.ai or digest != self.maze.digest[:8]
+                or ghosts != len(self.ghost_sprites) or pellets != self.bll):
+            raise ValueError("snapshot is of a different map, ghost count or ghost AI")
+        columns = 4 + self.ghosts.cursor_columns
+        offset = snapshot_header.size
+        if len(data) != offset + snapshot_pacman.size + snapshot_input.size + ghosts * columns * 4 + (pellets + 7) // 8:
+            raise ValueError("snapshot has the wrong length")
+        left, top, change_x, change_y, ghost_ticks = snapshot_pacman.unpack_from(data, offset)
+        offset += snapshot_pacman.size
+        *held, queued, queued_tick = snapshot_input.unpack_from(data, offset)
+        offset += snapshot_input.size
+        if max(held + [queued if queued != 255 else 0]) >= len(steer_directions):
+            raise ValueError("snapshot has an unknown direction")
+        state = np.frombuffer(data, dtype=np.int32, count=ghosts * columns, offset=offset).reshape(ghosts, columns)
+        offset += state.nbytes
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8, offset=offset), count=pellets).astype(bool)
+
+        engine = self.ghosts
+        engine.set_cursors(state[:, 4:])  # First, as it is what checks the ghost cursors
+        self.Pacman.rect.left = left
+        self.Pacman.rect.top = top
+        self.Pacman.change_x = change_x
+        self.Pacman.change_y = change_y
+        self.held = [steer_directions[index] for index in held if index]
+        self.queued = None if queued == 255 else (steer_directions[queued], queued_tick, None)
+        self.turned = []
+
+        engine.pos = state[:, 0:2].astype(np.int64)
+        engine.vel = state[:, 2:4].astype(np.int64)
+        engine.ticks = ghost_ticks
+        engine.sync(self.ghost_sprites)
+
+        # Only pellets whose state differs are moved in or out of the sprite groups
+        for index in np.flatnonzero(bits != self.pellet_mask).tolist():
+            key = self.pellet_keys[index]
+            block = self.pellet_pool[key]
+            if bits[index]:
+                self.pellets[key] = block
+                self.block_list.add(block)
+                self.all_sprites_list.add(block)
+            else:
+                del self.pellets[key]
+                block.kill()
+        self.pellet_mask[:] = bits
+
+        self.score = score
+        self.ticks = ticks
+        self.eaten = []
+
+    def handle_key(self, event_type, key, at=None):
+        # Keys take effect on the next tick; `at` is when the key arrived (perf_counter), for
+        # measuring the latency to the motion it causes
+        direction = key_directions.get(key)
+        if direction is None:
+            return
+        if self.recorder:
+            self.recorder.key(self.ticks, event_type, key)
+        if self.legacy_input:
+            if event_type == pygame.KEYDOWN:
+                self.Pacman.changespeed(direction[0], direction[1])
+            elif event_type == pygame.KEYUP:
+                self.Pacman.changespeed(-direction[0], -direction[1])
+            return
+        if event_type == pygame.KEYDOWN:
+            if direction in self.held:
+                self.held.remove(direction)
+            self.held.append(direction)
+            self.queued = (direction, self.ticks, at)
+        elif event_type == pygame.KEYUP and direction in self.held:
+            self.held.remove(direction)
+            # Releasing the key Pacman moves by stops him, or hands over to a key still held. A turn
+            # still queued for the released key is kept, so a quick tap before a corner turns too.
+            if self.queued is None and direction == (self.Pacman.change_x, self.Pacman.change_y):
+                self.queued = (self.held[-1] if self.held else (0, 0), self.ticks, at)
+
+    def release_keys(self):
+        # For a round resumed in a new session, where none of the keys held before are held now
+        self.Pacman.change_x = 0
+        self.Pacman.change_y = 0
+        self.held = []
+        self.queued = None
+
+    def can_move(self, direction):
+        rect = self.Pacman.rect.move(direction)
+        return not self.wall_grid.collides(rect) and not self.gate_grid.collides(rect)
+
+    def steer(self):
+        # Makes the queued turn once Pacman can move that way; until then he carries on as he was
+        direction, tick, at = self.queued
+        pacman = self.Pacman
+        current = (pacman.change_x, pacman.change_y)
+        waited = self.ticks - tick
+        if direction == current:
+            self.queued = None
+        elif direction == (0, 0) or current == (0, 0) or self.can_move(direction) \
+                or (waited >= self.turn_buffer and direction in self.held and current not in self.held):
+            # While both keys are held the turn waits for the opening; once the key Pacman moves by
+            # is released, a turn still impossible is made anyway and stops him
+            pacman.change_x, pacman.change_y = direction
+            self.queued = None
+            if at is not None:
+                self.turned.append(at)
+            if direction != (0, 0) and direction not in self.held:
+                # The key was tapped: go on by the keys still held, or stop
+                self.queued = (self.held[-1] if self.held else (0, 0), self.ticks, None)
+        elif waited >= self.turn_buffer and direction not in self.held:
+            self.queued = None  # A tapped turn that did not become possible in time is dropped
+            if current not in self.held:
+                self.queued = (self.held[-1] if self.held else (0, 0), self.ticks, None)
+
+    def eat_pellets(self):
+        # Only the pellet cells under Pacman's rect can be hit, which is one cell when aligned
+        rect = self.Pacman.rect
+        spacing = self.maze.cell
+        offset = self.maze.pellet_offset
+        size = self.maze.pellet_size
+        eaten = []
+        for row in range((rect.top - offset - size) // spacing + 1, (rect.bottom - offset - 1) // spacing + 1):
+            for column in range((rect.left - offset - size) // spacing + 1, (rect.right - offset - 1) // spacing + 1):
+                block = self.pellets.pop((row, column), None)
+                if block is not None:
+                    block.kill()
+                    self.pellet_mask[self.pellet_index[row, column]] = False
+                    eaten.append(block)
+        return eaten
+
+    def tick(self):
+        # Advance one frame; returns "won", "lost" or None while the round is still running
+        profiler = self.profiler
+        if self.turned:
+            self.turned = []
+        if self.queued is not None:
+            self.steer()
+        self.ticks += 1
+        self.Pacman.update(self.wall_grid, self.gate_grid)
+        if profiler:
+            profiler.mark("player")
+
+        self.ghosts.step(self.Pacman)
+        self.ghosts.sync(self.ghost_sprites)
+        if profiler:
+            profiler.mark("ghosts")
+
+        self.eaten = self.eat_pellets()
+        self.score += len(self.eaten)
+        if profiler:
+            profiler.mark("pellets")
+
+        if self.score == self.bll:
+            return "won"
+        if self.ghosts.hits(self.Pacman.rect):
+            return "lost"
+        return None
+
+
+class ScriptedInput:
+    # Replays (tick, event_type, key) tuples, e.g. (0, pygame.KEYDOWN, pygame.K_LEFT)
+    def __init__(self, events):
+        self.events = {}
+        for tick, event_type, key in events:
+            self.events.setdefault(tick, []).append((event_type, key))
+
+    def poll(self, tick):
+        return self.events.get(tick, ())
+
+
+class RandomInput:
+    # Holds a random direction key and switches to another one every `hold` ticks
+    keys = [pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN]
+
+    def __init__(self, seed=None, hold=4):
+        self.random = random.Random(seed)
+        self.hold = hold
+        self.current = None
+
+    def poll(self, tick):
+        if tick % self.hold:
+            return ()
+        events = []
+        if self.current is not None:
+            events.append((pygame.KEYUP, self.current))
+        self.current = self.random.choice(self.keys)
+        events.append((pygame.KEYDOWN, self.current))
+        return events
+
+
+# Input recordings: a header, then one (tick, code) record per key event that reached the round.
+# The code is the key's index in recording_keys, plus len(recording_keys) for a KEYUP. A round
+# ends with (ticks, 0x80 + status index) followed by the final score, so replays can be checked.
+recording_magic = b"PMRC"
+recording_version = 3
+recording_keys = list(key_directions)
+recording_statuses = ["won", "lost", "quit", "timeout"]
+recording_header = struct.Struct("<4sHHq")  # Magic, version, ghost count, seed
+recording_ai = struct.Struct("<B")  # Index into ghost_ais, from version 2; version 1 is "routes"
+recording_input = struct.Struct("<B")  # Turn buffer ticks, from version 3; earlier keys changed the speed directly
+recording_event = struct.Struct("<IB")
+recording_score = struct.Struct("<I")
+
+
+class InputRecorder:
+    # Each round is buffered and appended when it ends, so a crash only loses the round in progress
+    def __init__(self, path, seed=0, ghosts=None, ai=None, turn_buffer=None):
+        self.path = path
+        self.seed = seed
+        self.file = open(path, "wb")
+        self.file.write(recording_header.pack(recording_magic, recording_version, ghosts or ghost_count, seed))
+        self.file.write(recording_ai.pack(ghost_ais.index(ai or ghost_ai)))
+        self.file.write(recording_input.pack(turn_buffer_ticks if turn_buffer is None else turn_buffer))
+        self.file.flush()
+        self.buffer = bytearray()
+
+    def key(self, tick, event_type, key):
+        code = recording_keys.index(key)
+        if event_type == pygame.KEYUP:
+            code += len(recording_keys)
+        self.buffer += recording_event.pack(tick, code)
+
+    def end_round(self, game, status):
+        self.buffer += recording_event.pack(game.ticks, 0x80 + recording_statuses.index(status))
+        self.buffer += recording_score.pack(game.score)
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer.clear()
+
+    def close(self):
+        self.file.write(self.buffer)  # A round cut short is kept too, just without an ending
+        self.buffer.clear()
+        self.file.close()
+
+
+def read_recording(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, ghosts, seed = recording_header.unpack_from(data)
+    if magic != recording_magic:
+        raise ValueError(f"{path} is not a Pacman recording")
+    if not 1 <= version <= recording_version:
+        raise ValueError(f"{path} is recording version {version}, this game reads up to version {recording_version}")
+
+    offset = recording_header.size
+    ai = "routes"
+    if version >= 2:
+        ai = ghost_ais[recording_ai.unpack_from(data, offset)[0]]
+        offset += recording_ai.size
+    turn_buffer = None
+    if version >= 3:
+        turn_buffer, = recording_input.unpack_from(data, offset)
+        offset += recording_input.size
+
+    rounds = []
+    events = []
+    while offset + recording_event.size <= len(data):
+        tick, code = recording_event.unpack_from(data, offset)
+        offset += recording_event.size
+        if code & 0x80:
+            score, = recording_score.unpack_from(data, offset)
+            offset += recording_score.size
+            rounds.append({"events": events, "ticks": tick, "status": recording_statuses[code & 0x7f], "score": score})
+            events = []
+        else:
+            event_type = pygame.KEYUP if code >= len(recording_keys) else pygame.KEYDOWN
+            events.append((tick, event_type, recording_keys[code % len(recording_keys)]))
+    if events:
+        rounds.append({"events": events, "ticks": None, "status": None, "score": None})
+    return {"version": version, "ghosts": ghosts, "seed": seed, "ai": ai, "turn_buffer": turn_buffer, "rounds": rounds}
+
+
+def run_headless(inputs=None, max_ticks=10000, ghosts=None, profiler=None, game=None, view=None, render_every=1):
+    # Runs one round with no window, audio or frame cap and reports how fast it simulated.
+    # With a view, every render_every-th tick (and the last one) is drawn to the display.
+    if game is None:
+        game = GameRound(ghosts)
+    else:
+        game.reset()
+    game.profiler = profiler
+    status = None
+    ticks = 0
+    eaten = []
+    if view is not None:
+        view.start_round()
+    start = time.perf_counter()
+    while status is None and ticks < max_ticks:
+        if profiler:
+            profiler.begin_frame()
+        if inputs is not None:
+            for event_type, key in inputs.poll(ticks):
+                game.handle_key(event_type, key)
+        if profiler:
+            profiler.mark("events")
+        status = game.tick()
+        ticks += 1
+        if profiler:
+            profiler.end_frame(game, 1)
+        if view is not None:
+            eaten += game.eaten
+            if ticks % render_every == 0 or status is not None or ticks == max_ticks:
+                pygame.display.update(view.draw(eaten, True, 1.0))
+                pygame.event.pump()
+                eaten = []
+    elapsed = time.perf_counter() - start
+    if game.recorder:
+        game.recorder.end_round(game, status or "timeout")
+    return {
+        "status": status or "timeout",
+        "score": game.score,
+        "total": game.bll,
+        "ticks": ticks,
+        "seconds": elapsed,
+        "ticks_per_second": ticks / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def replay_recording(path, max_ticks=10000, view_factory=None, render_every=1):
+    # Feeds each recorded round back through GameRound at full speed; returns (round, result) pairs.
+    # Rounds that ended are replayed to their recorded tick so the scores can be compared exactly.
+    recording = read_recording(path)
+    random.seed(recording["seed"])
+    game = GameRound(recording["ghosts"], ai=recording["ai"], legacy_input=recording["turn_buffer"] is None)
+    if recording["turn_buffer"] is not None:
+        game.turn_buffer = recording["turn_buffer"]
+    view = view_factory(game) if view_factory else None
+    results = []
+    for recorded in recording["rounds"]:
+        ticks = recorded["ticks"] if recorded["ticks"] is not None else max_ticks
+        result = run_headless(ScriptedInput(recorded["events"]), ticks, game=game, view=view, render_every=render_every)
+        results.append((recorded, result))
+    return results
+
+
+# Environment actions: the direction Pacman is steered in, as if that one key were held down
+env_actions = [(0, 0), (0, -30), (-30, 0), (0, 30), (30, 0)]  # None, up, left, down, right
+env_statuses = ["playing", "won", "lost", "timeout"]
+env_channels = ["walls", "pellets", "pacman", "ghosts"]
+
+
+class PacmanEnv:
+    # reset()/step() interface to one round for bots. Observations are uint8 arrays of shape
+    # (len(env_channels), nav_rows, nav_columns) over the map's navigation grid: wall cells, pellet
+    # cells, Pacman's cell and the number of ghosts in each cell. The reward is the pellets eaten.
+    # The same array is filled in place on every call, so copy it to keep an observation.
+    def __init__(self, maze=None, ghosts=None, ai=None, max_ticks=10000, observation=None):
+        self.game = GameRound(ghosts, maze, ai)
+        maze = self.game.maze
+        self.max_ticks = max_ticks
+        self.shape = (len(env_channels), maze.nav_rows, maze.nav_columns)
+        self.observation = np.zeros(self.shape, dtype=np.uint8) if observation is None else observation
+
+        self.walls = (np.frombuffer(bytes(maze.nav), dtype=np.uint8) == NAV_WALL).reshape(self.shape[1:])
+        self.pellet_cells = {}  # Pellet sprite -> flat nav cell it lies in
+        for block in self.game.pellet_pool.values():
+            column, row = maze.nav_cell(*block.rect.center)
+            self.pellet_cells[block] = min(max(row, 0), maze.nav_rows - 1) * maze.nav_columns \
+                + min(max(column, 0), maze.nav_columns - 1)
+        self.pellets = self.observation[1].reshape(-1)  # Kept up to date as pellets are eaten
+        self.status = "playing"
+
+    def reset(self):
+        self.game.reset()
+        self.status = "playing"
+        self.observation[0] = self.walls
+        self.pellets[:] = 0
+        self.pellets[list(self.pellet_cells.values())] = 1
+        return self.observe()
+
+    def snapshot(self):
+        return self.game.snapshot()
+
+    def restore(self, snapshot):
+        # Continues from a GameRound.snapshot(), e.g. to fork many runs from one mid-game state
+        self.game.restore(snapshot)
+        self.status = "playing"
+        self.observation[0] = self.walls
+        self.pellets[:] = 0
+        self.pellets[[self.pellet_cells[block] for block in self.game.pellets.values()]] = 1
+        return self.observe()
+
+    def observe(self):
+        # Sprites are counted in the cell their top-left corner is nearest to
+        maze = self.game.maze
+        observation = self.observation
+        rows, columns = self.shape[1:]
+        column, row = maze.nav_cell(self.game.Pacman.rect.left + maze.cell // 2, self.game.Pacman.rect.top + maze.cell // 2)
+        observation[2] = 0
+        observation[2, min(max(row, 0), rows - 1), min(max(column, 0), columns - 1)] = 1
+        cells = (self.game.ghosts.pos - maze.nav_origin + maze.cell // 2) // maze.cell
+        cells = np.minimum(np.maximum(cells, 0), [columns - 1, rows - 1])
+        counts = np.bincount(cells[:, 1] * columns + cells[:, 0], minlength=rows * columns)
+        observation[3] = np.minimum(counts, 255).reshape(rows, columns)
+        return observation
+
+    def step(self, action):
+        pacman = self.game.Pacman
+        pacman.change_x, pacman.change_y = env_actions[action]
+        old_score = self.game.score
+        status = self.game.tick()
+        for block in self.game.eaten:
+            self.pellets[self.pellet_cells[block]] = 0
+        if status is None and self.game.ticks >= self.max_ticks:
+            status = "timeout"
+        self.status = status or "playing"
+        info = {"status": self.status, "score": self.game.score, "ticks": self.game.ticks}
+        return self.observe(), self.game.score - old_score, status is not None, info
+
+
+def vectorWorker(connection, shared, shape, first, count, options):
+    # Runs games first..first+count of a VectorEnv, reading actions from and writing results to the
+    # shared arrays whenever the parent asks for a "reset" or a "step"
+    observations = np.frombuffer(shared[0], dtype=np.uint8).reshape(-1, *shape)
+    actions = np.frombuffer(shared[1], dtype=np.int8)
+    rewards = np.frombuffer(shared[2], dtype=np.int32)
+    dones = np.frombuffer(shared[3], dtype=np.int8)
+    scores = np.frombuffer(shared[4], dtype=np.int32)
+    statuses = np.frombuffer(shared[5], dtype=np.int8)
+
+    maze = load_map(options["map"])
+    envs = [PacmanEnv(maze, options["ghosts"], options["ai"], options["max_ticks"], observations[index])
+            for index in range(first, first + count)]
+    while True:
+        command = connection.recv()
+        if command == "reset":
+            for env in envs:
+                env.reset()
+        elif command == "step":
+            for index, env in enumerate(envs, first):
+                _, rewards[index], done, info = env.step(actions[index])
+                dones[index] = done
+                scores[index] = info["score"]
+                statuses[index] = env_statuses.index(info["status"])
+                if done:
+                    env.reset()  # Finished games start over; scores and statuses keep the final result
+        else:
+            break
+        connection.send(command)
+    connection.close()
+
+
+class VectorEnv:
+    # Steps `count` independent PacmanEnvs split over `workers` processes. Actions, observations,
+    # rewards and results live in shared memory, so a step only sends a short command to each
+    # worker. step() returns (observations, rewards, dones, infos) as arrays indexed by game; a
+    # finished game is reset at once, so its observation is already the next game's first one.
+    def __init__(self, count, workers=None, map_path=None, ghosts=None, ai=None, max_ticks=10000):
+        workers = max(1, min(workers or os.cpu_count() or 1, count))
+        maze = load_map(map_path)
+        self.count = count
+        self.workers = workers
+        self.shape = (len(env_channels), maze.nav_rows, maze.nav_columns)
+
+        context = multiprocessing.get_context("spawn")
+        size = count * int(np.prod(self.shape))
+        self.shared = (context.RawArray('B', size), context.RawArray('b', count), context.RawArray('i', count),
+                       context.RawArray('b', count), context.RawArray('i', count), context.RawArray('b', count))
+        self.observations = np.frombuffer(self.shared[0], dtype=np.uint8).reshape(count, *self.shape)
+        self.actions = np.frombuffer(self.shared[1], dtype=np.int8)
+        self.rewards = np.frombuffer(self.shared[2], dtype=np.int32)
+        self.dones = np.frombuffer(self.shared[3], dtype=np.int8)
+        self.scores = np.frombuffer(self.shared[4], dtype=np.int32)
+        self.statuses = np.frombuffer(self.shared[5], dtype=np.int8)
+
+        options = {"map": map_path or map_file, "ghosts": ghosts, "ai": ai or ghost_ai, "max_ticks": max_ticks}
+        self.connections = []
+        self.processes = []
+        for worker in range(workers):
+            first = count * worker // workers
+            last = count * (worker + 1) // workers
+            parent, child = context.Pipe()
+            process = context.Process(target=vectorWorker,
+                                      args=(child, self.shared, self.shape, first, last - first, options), daemon=True)
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def command(self, command):
+        for connection in self.connections:
+            connection.send(command)
+        for connection in self.connections:
+            connection.recv()
+
+    def reset(self):
+        self.command("reset")
+        return self.observations
+
+    def step(self, actions):
+        self.actions[:] = actions
+        self.command("step")
+        infos = {"score": self.scores, "status": self.statuses}
+        return self.observations, self.rewards, self.dones.astype(bool), infos
+
+    def close(self):
+        for connection, process in zip(self.connections, self.processes):
+            try:
+                connection.send("close")
+            except OSError as e:
+                print(f"Failed to stop environment worker: {e}")
+            process.join()
+        self.connections = []
+        self.processes = []
+
+
+class FrameProfiler:
+    # Times each phase of the game loop with perf_counter_ns. Keeps the last `window` frames for
+    # the overlay (toggled with F3) and can stream one JSON record per frame to a file.
+    # Loops only call it when profiling is on, so it costs nothing otherwise. Input latency is the
+    # time from a key arriving to the first frame showing the motion it caused.
+    phases = ["events", "player", "ghosts", "pellets", "score", "draw", "present", "idle"]
+
+    def __init__(self, jsonl_path=None, window=300):
+        self.history = {phase: deque(maxlen=window) for phase in self.phases}
+        self.frame_times = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+        self.frame_latencies = []
+        self.current = dict.fromkeys(self.phases, 0)
+        self.frames = 0
+        self.started = time.perf_counter_ns()
+        self.frame_start = self.last = self.started
+        self.file = open(jsonl_path, "a", buffering=1 << 16) if jsonl_path else None
+        self.overlay_visible = False
+        self.overlay = None
+        self.overlay_time = 0
+
+    def begin_frame(self):
+        self.frame_start = self.last = time.perf_counter_ns()
+
+    def mark(self, phase):
+        # Charges the time since the previous mark to `phase`
+        now = time.perf_counter_ns()
+        self.current[phase] += now - self.last
+        self.last = now
+
+    def shown(self, arrivals):
+        # Keys (perf_counter arrival times) whose motion the frame just presented shows
+        now = time.perf_counter()
+        for arrival in arrivals:
+            self.frame_latencies.append((now - arrival) * 1e9)
+        self.latencies.extend(self.frame_latencies)
+
+    def end_frame(self, game, ticks):
+        frame_ns = self.last - self.frame_start
+        self.frame_times.append(frame_ns)
+        for phase in self.phases:
+            self.history[phase].append(self.current[phase])
+        if self.file is not None:
+            record = {"frame": self.frames, "t": (self.frame_start - self.started) / 1e9, "ticks": ticks,
+                      "frame_ms": frame_ns / 1e6, "ghosts": len(game.ghost_sprites), "pellets": len(game.pellets)}
+            for phase in self.phases:
+                record[phase + "_ms"] = self.current[phase] / 1e6
+            if self.frame_latencies:
+                record["input_ms"] = [latency / 1e6 for latency in self.frame_latencies]
+            self.file.write(json.dumps(record) + "\n")
+        self.current = dict.fromkeys(self.phases, 0)
+        self.frame_latencies = []
+        self.frames += 1
+
+    def stats(self, phase):
+        # (mean, p95) of a phase (or "input" latency) over the window, in milliseconds
+        values = sorted(self.latencies if phase == "input" else self.history[phase])
+        if not values:
+            return 0.0, 0.0
+        return sum(values) / len(values) / 1e6, values[int(len(values) * 0.95) - 1 if len(values) > 1 else 0] / 1e6
+
+    def draw_overlay(self, screen, font, game):
+        # The text is only re-rendered twice a second; returns the rect to present
+        now = time.perf_counter_ns()
+        if self.overlay is None or now - self.overlay_time > 500000000:
+            self.overlay_time = now
+            total = sum(self.frame_times)
+            fps = len(self.frame_times) * 1e9 / total if total else 0.0
+            lines = [f"FPS {fps:.1f}  sprites {len(game.pellets) + len(game.ghost_sprites) + 1}"
+                     f"  ghosts {len(game.ghost_sprites)}  pellets {len(game.pellets)}"]
+            for phase in self.phases + ["input"]:
+                mean, p95 = self.stats(phase)
+                lines.append(f"{phase:<8} {mean:6.2f} ms  p95 {p95:6.2f} ms")
+            surfaces = [font.render(line, True, white) for line in lines]
+            self.overlay = pygame.Surface((max(surface.get_width() for surface in surfaces) + 8,
+                                           sum(surface.get_height() for surface in surfaces) + 8))
+            self.overlay.fill((40, 40, 40))
+            y = 4
+            for surface in surfaces:
+                self.overlay.blit(surface, (4, y))
+                y += surface.get_height()
+        rect = self.overlay.get_rect(topright=(screen.get_width() - 8, 8))
+        screen.blit(self.overlay, rect)
+        return rect
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class GameView:
+    # Draws a GameRound. The maze is rendered once; the background holds the maze plus the pellets
+    # still on the board, and each frame only redraws moving sprites, eaten pellets and the score
+    # text, returning the dirty rects to present.
+    def __init__(self, screen, game, font):
+        self.screen = screen
+        self.game = game
+        self.font = font
+
+        self.maze = pygame.Surface(screen.get_size()).convert()
+        self.maze.fill(black)
+        game.wall_list.draw(self.maze)
+        game.gate.draw(self.maze)
+
+        self.background = self.maze.copy()
+        self.movers = [game.Pacman] + game.ghost_sprites
+        self.moving_list = pygame.sprite.RenderUpdates(*self.movers)
+        self.start_positions = [sprite.rect.topleft for sprite in self.movers]
+        self.text = None
+        self.text_rect = None
+
+    def render_score(self):
+        self.text = text_cache.render(self.font, "Score: " + str(self.game.score) + "/" + str(self.game.bll), red)
+        self.text_rect = self.text.get_rect(topleft=(10, 10))
+
+    def start_round(self):
+        self.background.blit(self.maze, (0, 0))
+        self.game.block_list.draw(self.background)
+        self.start_positions = [sprite.rect.topleft for sprite in self.movers]
+        self.render_score()
+        self.redraw()
+
+    def redraw(self):
+        # Full repaint of the current state, e.g. after something was drawn over the board
+        self.screen.blit(self.background, (0, 0))
+        self.moving_list.draw(self.screen)
+        self.screen.blit(self.text, self.text_rect)
+        pygame.display.flip()
+
+    def before_tick(self):
+        # Remember where the sprites were so frames can interpolate towards the next tick
+        self.start_positions = [sprite.rect.topleft for sprite in self.movers]
+
+    def draw(self, eaten, score_changed, alpha):
+        screen = self.screen
+        background = self.background
+        self.moving_list.clear(screen, background)
+        dirty = []
+
+        for block in eaten:
+            background.blit(self.maze, block.rect, block.rect)
+            screen.blit(background, block.rect, block.rect)
+            dirty.append(block.rect)
+
+        if score_changed:
+            screen.blit(background, self.text_rect, self.text_rect)
+            dirty.append(self.text_rect)
+            self.render_score()
+
+        # Sprites are drawn part way from where they were at the previous tick to where they are now
+        positions = [sprite.rect.topleft for sprite in self.movers]
+        for sprite, (start_x, start_y), (x, y) in zip(self.movers, self.start_positions, positions):
+            sprite.rect.topleft = (round(start_x + (x - start_x) * alpha), round(start_y + (y - start_y) * alpha))
+
+        dirty += self.moving_list.draw(screen)
+
+        if score_changed or self.text_rect.collidelist(dirty) != -1:
+            # Antialiased text must not be blended over itself, so rebuild the area underneath first
+            screen.blit(background, self.text_rect, self.text_rect)
+            for sprite in self.movers:
+                if sprite.rect.colliderect(self.text_rect):
+                    screen.blit(sprite.image, sprite.rect)
+            screen.blit(self.text, self.text_rect)
+            dirty.append(self.text_rect)
+
+        for sprite, position in zip(self.movers, positions):
+            sprite.rect.topleft = position
+
+        return dirty
+
+
+window_size = (606, 606)  # Largest window; bigger maps scroll
+
+
+def screenSize(maze):
+    return [min(maze.size[0], window_size[0]), min(maze.size[1], window_size[1])]
+
+
+class ScrollingView(GameView):
+    # Draws a GameRound whose map is larger than the window through a camera that follows Pacman.
+    # Walls and pellets are grouped by world chunk and each chunk's background is rendered when
+    # it first comes into view, keeping only the most recently seen ones, so the cost of a frame
+    # depends on the window size rather than the size of the map.
+    def __init__(self, screen, game, font):
+        self.screen = screen
+        self.game = game
+        self.font = font
+        self.camera = pygame.Rect((0, 0), screen.get_size())
+        self.world = pygame.Rect((0, 0), game.maze.size)
+
+        # Sprites are listed in every chunk they overlap and clipped to it when drawn. Plain lists,
+        # since eaten pellets are killed and would otherwise drop out of a chunk's group for good.
+        self.chunks = {}
+        for sprite in list(game.wall_list) + list(game.gate):
+            for key in self.chunk_keys(sprite.rect):
+                self.chunks.setdefault(key, []).append(sprite)
+        self.pellet_chunks = {}
+        for block in game.pellet_pool.values():
+            for key in self.chunk_keys(block.rect):
+                self.pellet_chunks.setdefault(key, []).append(block)
+
+        visible = (screen.get_width() // chunk_size + 2) * (screen.get_height() // chunk_size + 2)
+        self.surfaces = OrderedDict()
+        self.max_surfaces = visible * 2
+
+        self.movers = [game.Pacman] + game.ghost_sprites
+        self.start_positions = [sprite.rect.topleft for sprite in self.movers]
+        self.text = None
+        self.text_rect = None
+
+    def chunk_keys(self, rect):
+        return [(column, row)
+                for column in range(rect.left // chunk_size, (rect.right - 1) // chunk_size + 1)
+                for row in range(rect.top // chunk_size, (rect.bottom - 1) // chunk_size + 1)]
+
+    def chunk_surface(self, key):
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = pygame.Surface((chunk_size, chunk_size)).convert()
+            surface.fill(black)
+            offset = (-key[0] * chunk_size, -key[1] * chunk_size)
+            for sprite in self.chunks.get(key, ()):
+                surface.blit(sprite.image, sprite.rect.move(offset))
+            for block in self.pellet_chunks.get(key, ()):
+                if block.alive():
+                    surface.blit(block.image, block.rect.move(offset))
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.max_surfaces:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+    def start_round(self):
+        self.surfaces.clear()  # Every pellet is back
+        self.start_positions = [sprite.rect.topleft for sprite in self.movers]
+        self.render_score()
+        self.redraw()
+
+    def redraw(self):
+        self.draw([], False, 1.0)
+        pygame.display.flip()
+
+    def draw(self, eaten, score_changed, alpha):
+        screen = self.screen
+
+        # Eaten pellets are painted out of the chunk backgrounds that are kept
+        for block in eaten:
+            for key in self.chunk_keys(block.rect):
+                surface = self.surfaces.get(key)
+                if surface is not None:
+                    offset = (-key[0] * chunk_size, -key[1] * chunk_size)
+                    area = block.rect.move(offset)
+                    surface.fill(black, area)
+                    surface.set_clip(area)
+                    for sprite in self.chunks.get(key, ()):
+                        surface.blit(sprite.image, sprite.rect.move(offset))
+                    surface.set_clip(None)
+
+        if score_changed:
+            self.render_score()
+
+        positions = [sprite.rect.topleft for sprite in self.movers]
+        for sprite, (start_x, start_y), (x, y) in zip(self.movers, self.start_positions, positions):
+            sprite.rect.topleft = (round(start_x + (x - start_x) * alpha), round(start_y + (y - start_y) * alpha))
+
+        pacman = self.game.Pacman.rect
+        self.camera.center = pacman.center
+        self.camera.clamp_ip(self.world)
+
+        camera = self.camera
+        for key in self.chunk_keys(camera):
+            screen.blit(self.chunk_surface(key), (key[0] * chunk_size - camera.left, key[1] * chunk_size - camera.top))
+        for sprite in self.movers:
+            if sprite.rect.colliderect(camera):
+                screen.blit(sprite.image, sprite.rect.move(-camera.left, -camera.top))
+        screen.blit(self.text, self.text_rect)
+
+        for sprite, position in zip(self.movers, positions):
+            sprite.rect.topleft = position
+
+        return [screen.get_rect()]
+
+
+def makeView(screen, game, font):
+    # Maps that fit the window keep the fixed view with its dirty-rect updates
+    if game.maze.size[0] <= screen.get_width() and game.maze.size[1] <= screen.get_height():
+        return GameView(screen, game, font)
+    return ScrollingView(screen, game, font)
+
+
+class GameChannel:
+    # Score, scene and timing of a running game in a small shared-memory block. The game process
+    # is the only writer and the GUI only polls it, so plain stores and loads are enough.
+    SCORE, STATE, TICKS, FRAME_MS, FIRST_FRAME = range(5)
+    size = 5
+    states = ["starting", "playing", "won", "lost", "quit"]
+
+    def __init__(self, shared):
+        self.shared = shared
+
+    def emit(self, score):
+        self.shared[self.SCORE] = score
+
+    def set_state(self, state):
+        self.shared[self.STATE] = self.states.index(state)
+
+    def frame(self, ticks, frame_seconds):
+        self.shared[self.TICKS] = ticks
+        self.shared[self.FRAME_MS] = frame_seconds * 1000.0
+
+    def shown(self):
+        # Wall-clock time the first frame of the game reached the screen
+        if not self.shared[self.FIRST_FRAME]:
+            self.shared[self.FIRST_FRAME] = time.time()
+
+    def first_frame(self):
+        return self.shared[self.FIRST_FRAME]
+
+    def read(self):
+        return {
+            "score": int(self.shared[self.SCORE]),
+            "state": self.states[int(self.shared[self.STATE])],
+            "ticks": int(self.shared[self.TICKS]),
+            "frame_ms": self.shared[self.FRAME_MS],
+        }
+
+
+def userFileName(username):
+    # A file name for the user's saves and recordings that stays inside its directory. Names of
+    # plain letters, digits, "_" and "-" are used as they are; anything else is replaced and made
+    # unique again with a hash of the name after a ".", which plain names cannot contain
+    if re.fullmatch(r"[A-Za-z0-9_-]{1,64}", username):
+        return username
+    digest = hashlib.sha256(username.encode()).hexdigest()[:16]
+    return f"{re.sub(r'[^A-Za-z0-9_-]', '_', username)[:32]}.{digest}"
+
+
+def runGame(shared, username, go=None):
+    # Entry point of the game process started by MyApp. A process started ahead of time by
+    # MyApp.warm_up loads everything it can without a window and then waits for Play.
+    if go is not None:
+        warmUp()
+        parent = multiprocessing.parent_process()
+        while not go.wait(1.0):
+            if parent is not None and not parent.is_alive():
+                return  # The menu went away without Play being pressed
+    startGame(GameChannel(shared), username)
+
+
+def warmUp():
+    # Only files: initializing SDL audio or video here would also install SDL's signal handlers,
+    # and a process waiting for Play would then ignore being terminated
+    load_map()
+    assets.preload()  # Images are converted for the screen once the window exists
+
+
+def startGame(channel, username):
+    pygame.display.init()
+    Trollicon = assets.image('Trollman.png')
+    pygame.display.set_icon(Trollicon)
 
-            pygame.display.flip()
+    if assets.music(music_file):
+        pygame.mixer.music.play(-1, 0.0)
 
-            clock.tick(10)
+    screen = pygame.display.set_mode(screenSize(load_map()))
+    pygame.display.set_caption('Pacman')
+    assets.preload()
+
+    clock = pygame.time.Clock()
+    font = assets.font("freesansbold.ttf", 24)
+
+    writer = get_score_writer()
+
+    overlay = pygame.Surface((400, 200))
+    overlay.set_alpha(10)
+    overlay.fill((128, 128, 128))
+    play_again_text = text_cache.render(font, "To play again, press ENTER.", white)
+    quit_text = text_cache.render(font, "To quit, press ESCAPE.", white)
+
+    # One round object (and so one set of sprites) is reused for every game of the session
+    game = GameRound()
+
+    view = makeView(screen, game, font)
+
+    # PACMAN_PROFILE=frames.jsonl streams per-frame phase timings; F3 toggles the overlay
+    profile_path = os.environ.get("PACMAN_PROFILE")
+    profiler = FrameProfiler(profile_path) if profile_path else None
+    profiler_font = assets.font("freesansbold.ttf", 12)
+
+    def toggleOverlay():
+        nonlocal profiler
+        if profiler is None:
+            profiler = FrameProfiler()
+        profiler.overlay_visible = not profiler.overlay_visible
+        if not profiler.overlay_visible:
+            view.redraw()
+            if profiler.file is None:
+                profiler = None  # Nothing left to record, so stop paying for the timing calls
+        game.profiler = profiler
+
+    game.profiler = profiler
+
+    # Every session is recorded to recordings/ (or PACMAN_RECORD) so bug reports can be replayed;
+    # PACMAN_RECORD= (empty) turns recording off
+    record_dir = os.environ.get("PACMAN_RECORD", "recordings")
+    seed = random.randrange(2 ** 31)
+    random.seed(seed)
+    recorder = None
+    if record_dir:
+        try:
+            os.makedirs(record_dir, exist_ok=True)
+            record_path = os.path.join(record_dir, f"{userFileName(username)}-{time.strftime('%Y%m%d-%H%M%S')}.pmr")
+            recorder = InputRecorder(record_path, seed, len(game.ghost_sprites), game.ai, game.turn_buffer)
+        except OSError as e:
+            print(f"Failed to start recording: {e}")
+
+    # Closing the window mid-round suspends the round to saves/ (or PACMAN_SAVE) and the next
+    # session resumes it; PACMAN_SAVE= (empty) turns this off
+    save_dir = os.environ.get("PACMAN_SAVE", "saves")
+    save_path = os.path.join(save_dir, f"{userFileName(username)}.pms") if save_dir else None
+    resumed = False
+    if save_path and os.path.exists(save_path):
+        try:
+            with open(save_path, "rb") as f:
+                game.restore(f.read())
+            game.release_keys()
+            resumed = True
+            channel.emit(game.score)
+        except (OSError, ValueError) as e:
+            print(f"Failed to resume game: {e}")
+        finally:
+            # Even when resuming failed, so a damaged save cannot break every later game
+            try:
+                os.remove(save_path)
+            except OSError as e:
+                print(f"Failed to remove saved game: {e}")
+    # A resumed round cannot be replayed from its start, so recording begins with the next round
+    game.recorder = None if resumed else recorder
+
+    def suspendRound():
+        try:
+            os.makedirs(save_dir, exist_ok=True)
+            with open(save_path + ".tmp", "wb") as f:
+                f.write(game.snapshot())
+            os.replace(save_path + ".tmp", save_path)
+        except OSError as e:
+            print(f"Failed to save game: {e}")
+
+    def playRound():
+        # Runs until the round ends; returns the next scene: "won", "lost" or "quit".
+        # The game ticks at a fixed tick_rate while frames are drawn as fast as frame_rate allows,
+        # with sprites interpolated between their positions at the last two ticks.
+        view.start_round()
+        channel.shown()
+
+        tick_length = 1.0 / tick_rate
+        lag = 0.0
+        previous_time = time.perf_counter()
+
+        while True:
+            if profiler:
+                profiler.begin_frame()
+
+            events = pygame.event.get()
+            arrived = time.perf_counter()
+            for event in events:
+                if event.type == pygame.QUIT:
+                    if game.recorder:
+                        game.recorder.end_round(game, "quit")
+                    if save_path:
+                        suspendRound()
+                    return "quit"
+
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    toggleOverlay()
+                elif event.type == pygame.KEYDOWN or event.type == pygame.KEYUP:
+                    game.handle_key(event.type, event.key, arrived)
+
+            if profiler:
+                profiler.mark("events")
+
+            now = time.perf_counter()
+            lag += now - previous_time
+            previous_time = now
+
+            old_score = game.score
+            status = None
+            eaten = []
+            turned = []
+            ticks = 0
+            while lag >= tick_length and status is None:
+                if ticks == max_catch_up_ticks:
+                    lag = 0.0  # Too far behind to catch up; drop the backlog instead of spiralling
+                    break
+                view.before_tick()
+                status = game.tick()
+                eaten += game.eaten
+                turned += game.turned
+                lag -= tick_length
+                ticks += 1
+
+            if game.score != old_score:
+                channel.emit(game.score)
+                writer.submit(username, game.score)
+            if profiler:
+                profiler.mark("score")
+
+            # The final frame of a round shows the real positions
+            alpha = min(lag / tick_length, 1.0) if status is None else 1.0
+            dirty = view.draw(eaten, game.score != old_score, alpha)
+            if profiler and profiler.overlay_visible:
+                dirty.append(profiler.draw_overlay(screen, profiler_font, game))
+            if profiler:
+                profiler.mark("draw")
+
+            pygame.display.update(dirty)
+            if profiler:
+                profiler.mark("present")
+                if turned:
+                    profiler.shown(turned)
+
+            if status is not None:
+                if game.recorder:
+                    game.recorder.end_round(game, status)
+                writer.record_game(username, game.score, status == "won")
+                writer.flush()
+                if profiler:
+                    profiler.end_frame(game, ticks)
+                return status
+
+            channel.frame(game.ticks, clock.get_time() / 1000.0)
+            clock.tick(frame_rate)
+            if profiler:
+                profiler.mark("idle")
+                profiler.end_frame(game, ticks)
+
+    def doNext(message, left):
+        # End-of-round screen; returns "playing" on ENTER or "quit"
+        message_text = text_cache.render(font, message, white)
 
-    def doNext(message, left, all_sprites_list, block_list, monsta_list, pacman_collide, wall_list, gate):
         while True:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
-                    pygame.quit()
+                    return "quit"
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_ESCAPE:
-                        pygame.quit()
+                        return "quit"
                     if event.key == pygame.K_RETURN:
-                        del all_sprites_list
-                        del block_list
-                        del monsta_list
-                        del pacman_collide
-                        del wall_list
-                        del gate
-                        startGame()
-
-            w = pygame.Surface((400, 200))
-            w.set_alpha(10)
-            w.fill((128, 128, 128))
-            screen.blit(w, (100, 200))
-
-            text1 = font.render(message, True, white)
-            screen.blit(text1, [left, 233])
-
-            text2 = font.render("To play again, press ENTER.", True, white)
-            screen.blit(text2, [135, 303])
-            text3 = font.render("To quit, press ESCAPE.", True, white)
-            screen.blit(text3, [165, 333])
+                        return "playing"
+
+            screen.blit(overlay, (100, 200))
+            screen.blit(message_text, [left, 233])
+            screen.blit(play_again_text, [135, 303])
+            screen.blit(quit_text, [165, 333])
 
             pygame.display.flip()
 
             clock.tick(60)
 
-    startGame()
+    scene = "playing"
+    while scene != "quit":
+        channel.set_state(scene)
+        if scene == "playing":
+            scene = playRound()
+        else:
+            if scene == "won":
+                scene = doNext("Congratulations, you won!", 145)
+            else:
+                scene = doNext("Game Over", 235)
+            if scene == "playing":
+                game.reset()
+                game.recorder = recorder
+                channel.emit(game.score)
+
+    channel.set_state("quit")
+    writer.flush(wait=True)
+    if profiler:
+        profiler.close()
+    if recorder:
+        recorder.close()
+    if pygame.mixer.get_init():
+        pygame.mixer.music.stop()
+    pygame.display.quit()
 
 
 def update_user_score(username, new_score):
     try:
         conn = sqlite3.connect(DATABASE_FILE)
         cursor = conn.cursor()
-        cursor.execute('UPDATE users SET best_score = ? WHERE username = ?', (new_score, username))
+        cursor.execute('UPDATE users SET best_score = ? WHERE username = ? AND IFNULL(best_score, 0) < ?',
+                       (new_score, username, new_score))
         conn.commit()
         conn.close()
     except Exception as e:
         print(f"Failed to update user score: {e}")
 
 
+class ScoreWriter:
+    # Write-behind persistence for best scores. The game loop only enqueues; a single writer
+    # thread owns a long-lived WAL connection, keeps the highest pending score per user and
+    # commits them together every flush_interval seconds or when flush() is called.
+    STOP = object()
+    FLUSH = object()
+
+    def __init__(self, database_file=DATABASE_FILE, flush_interval=2.0, max_queue=1024):
+        self.database_file = database_file
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflow = {}  # Updates that arrived while the queue was full
+        self.overflow_games = []
+        self.overflow_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name="ScoreWriter", daemon=True)
+        self.thread.start()
+
+    def submit(self, username, score):
+        try:
+            self.queue.put_nowait(("score", username, score))
+        except queue.Full:
+            with self.overflow_lock:
+                self.overflow[username] = max(score, self.overflow.get(username, score))
+
+    def record_game(self, username, score, won):
+        # Finished games are appended to the history table; unlike scores they are never coalesced
+        game = ("game", username, score, int(won), time.time())
+        try:
+            self.queue.put_nowait(game)
+        except queue.Full:
+            with self.overflow_lock:
+                self.overflow_games.append(game)
+
+    def flush(self, wait=False):
+        # Ask the writer to commit now; with wait=True block until it has
+        done = threading.Event() if wait else self.FLUSH
+        try:
+            self.queue.put(done, block=wait)
+        except queue.Full:
+            return  # The writer is busy draining and will pick everything up on its next commit
+        if wait:
+            done.wait()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(self.STOP)
+            self.thread.join()
+
+    def run(self):
+        conn = sqlite3.connect(self.database_file)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        except Exception as e:
+            print(f"Failed to enable WAL mode: {e}")
+
+        pending = {}
+        games = []
+        waiters = []
+        stopping = False
+        next_flush = time.monotonic() + self.flush_interval
+        while not stopping:
+            try:
+                item = self.queue.get(timeout=max(next_flush - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, tuple):
+                if item[0] == "game":
+                    games.append(item)
+                else:
+                    username, score = item[1], item[2]
+                    pending[username] = max(score, pending.get(username, score))
+                if time.monotonic() < next_flush:
+                    continue
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is self.STOP:
+                stopping = True
+
+            with self.overflow_lock:
+                for username, score in self.overflow.items():
+                    pending[username] = max(score, pending.get(username, score))
+                self.overflow.clear()
+                games.extend(self.overflow_games)
+                self.overflow_games = []
+
+            # A batch that fails, e.g. on a locked database, stays pending and is retried next time
+            if (pending or games) and self.write(conn, pending, games):
+                pending = {}
+                games = []
+            for waiter in waiters:
+                waiter.set()
+            waiters = []
+            next_flush = time.monotonic() + self.flush_interval
+
+        conn.close()
+
+    def write(self, conn, pending, games):
+        return writeScores(conn, pending, games)
+
+
+def writeScores(conn, pending, games):
+    # One transaction for a batch: best scores only ever go up, games are appended. Returns
+    # whether it was committed.
+    try:
+        with conn:
+            conn.executemany(
+                'UPDATE users SET best_score = ? WHERE username = ? AND IFNULL(best_score, 0) < ?',
+                [(score, username, score) for username, score in pending.items()])
+            conn.executemany('INSERT INTO games (username, score, won, played_at) VALUES (?, ?, ?, ?)',
+                             [game[1:] for game in games])
+    except Exception as e:
+        print(f"Failed to update user score: {e}")
+        return False
+    return True
+
+
+# PACMAN_SCORE_SERVER=unix:/path/to.sock or host:port sends scores to a shared ScoreServer instead
+# of every game writing wallet.db itself
+SCORE_SERVER = os.environ.get("PACMAN_SCORE_SERVER")
+
+
+def scoreServerSocket(address):
+    if address.startswith("unix:"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(5.0)
+        sock.connect(address[len("unix:"):])
+    else:
+        host, port = address.rsplit(":", 1)
+        sock = socket.create_connection((host, int(port)), timeout=5.0)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class ScoreServer:
+    # Score ingestion for many game clients sharing one database. Clients send one JSON object per
+    # line: {"op": "score", "user", "score"}, {"op": "game", "user", "score", "won", "at"} and
+    # {"op": "flush"} are applied without a reply (a flush with "reply": true is answered once
+    # committed); {"op": "leaderboard", "limit", "after"} and {"op": "rank", "user"} are answered
+    # from an in-memory ranking. Pending scores are coalesced per user and committed in one
+    # transaction every flush_interval seconds, or sooner once batch_size events are waiting.
+    def __init__(self, database_file=None, flush_interval=0.05, batch_size=5000):
+        self.database_file = database_file or DATABASE_FILE
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending = {}
+        self.games = []
+        self.scores = {}  # Best score of every known user, including scores not committed yet
+        self.ranking = []  # Sorted (-best_score, username), the leaderboard order
+        self.executor = ThreadPoolExecutor(max_workers=1)  # Owns the connection; commits off the event loop
+        self.conn = None
+        self.events = 0
+        self.clients = set()
+
+    def load(self):
+        self.conn = sqlite3.connect(self.database_file, check_same_thread=False)
+        try:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+        except Exception as e:
+            print(f"Failed to enable WAL mode: {e}")
+        rows = self.conn.execute('SELECT username, IFNULL(best_score, 0) FROM users').fetchall()
+        self.scores = dict(rows)
+        self.ranking = sorted((-score, username) for username, score in rows)
+
+    def rank(self, username, score):
+        # Moves a known user up the ranking; scores never go down
+        old = self.scores.get(username)
+        if old is None or score <= old:
+            return
+        del self.ranking[bisect_left(self.ranking, (-old, username))]
+        insort(self.ranking, (-score, username))
+        self.scores[username] = score
+
+    def accept(self, message):
+        # Events SQLite could not store are refused with ValueError here, as one of them in a batch
+        # would fail the whole commit
+        op = message.get("op")
+        if op in ("score", "game"):
+            username, score = message.get("user"), message.get("score")
+            if not isinstance(username, str):
+                raise ValueError("user must be a string")
+            if type(score) is not int or not -2 ** 63 <= score < 2 ** 63:
+                raise ValueError("score must be a 64-bit integer")
+        if op == "score":
+            if score > self.pending.get(username, -1):
+                self.pending[username] = score
+            self.rank(username, score)
+        elif op == "game":
+            won, at = message.get("won", False), message.get("at", time.time())
+            if not isinstance(won, (int, float)) or not isinstance(at, (int, float)):
+                raise ValueError("won and at must be numbers")
+            self.games.append(("game", username, score, int(bool(won)), at))
+        else:
+            return False
+        self.events += 1
+        if self.events >= self.batch_size:
+            self.wake.set()
+        return True
+
+    def leaderboard(self, limit, after):
+        start = 0 if after is None else bisect_right(self.ranking, (-after[0], after[1]))
+        rows = [[username, -score] for score, username in self.ranking[start:start + limit]]
+        return {"rows": rows, "cursor": [rows[-1][1], rows[-1][0]] if len(rows) == limit else None}
+
+    async def flush(self):
+        async with self.lock:
+            pending, games = self.pending, self.games
+            self.pending, self.games, self.events = {}, [], 0
+            if not pending and not games:
+                return
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(self.executor, writeScores, self.conn, pending, games):
+                # Kept for the next flush, merged with whatever arrived in the meantime
+                for username, score in pending.items():
+                    self.pending[username] = max(score, self.pending.get(username, score))
+                self.games[:0] = games
+                return
+            # Users registered after the server started join the ranking once their score is stored
+            unknown = [username for username in pending if username not in self.scores]
+            if unknown:
+                rows = await loop.run_in_executor(self.executor, self.lookup, unknown)
+                for username, score in rows:
+                    self.scores[username] = score
+                    insort(self.ranking, (-score, username))
+
+    def lookup(self, usernames):
+        marks = ",".join("?" * len(usernames))
+        return self.conn.execute(f'SELECT username, IFNULL(best_score, 0) FROM users WHERE username IN ({marks})',
+                                 usernames).fetchall()
+
+    async def flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await self.flush()
+
+    async def handle(self, reader, writer):
+        self.clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    if not isinstance(message, dict):
+                        raise ValueError("not a JSON object")
+                    if self.accept(message):
+                        continue
+                    op = message.get("op")
+                    if op == "flush":
+                        await self.flush()
+                        reply = {"ok": True} if message.get("reply") else None
+                    elif op == "leaderboard":
+                        reply = self.leaderboard(int(message.get("limit", 100)), message.get("after"))
+                    elif op == "rank":
+                        score = self.scores.get(message["user"])
+                        reply = {"rank": None if score is None else bisect_left(self.ranking, (-score,)) + 1}
+                    else:
+                        reply = {"error": f"unknown op {op!r}"}
+                except (ValueError, KeyError, TypeError, IndexError) as e:
+                    reply = {"error": f"bad message: {e}"}
+                if reply is not None:
+                    writer.write(json.dumps(reply).encode() + b"\n")
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def serve(self, address):
+        self.lock = asyncio.Lock()
+        self.wake = asyncio.Event()
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.load)
+        if address.startswith("unix:"):
+            path = address[len("unix:"):]
+            if os.path.exists(path):
+                os.remove(path)  # Left over from a server that did not shut down cleanly
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            host, port = address.rsplit(":", 1)
+            server = await asyncio.start_server(self.handle, host, int(port))
+        print(f"Score server listening on {address} with {len(self.scores)} users", flush=True)
+        stopping = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # No signal handlers on this platform; Ctrl+C still stops the server cleanly
+        flusher = asyncio.create_task(self.flush_loop())
+        try:
+            async with server:
+                await stopping.wait()
+                for writer in list(self.clients):
+                    writer.close()  # Handlers see end of stream and finish their last line
+                await asyncio.sleep(0)
+        finally:
+            flusher.cancel()
+            await self.flush()
+            self.executor.submit(self.conn.close).result()
+            self.executor.shutdown()
+
+
+class ScoreClient:
+    # ScoreWriter's interface for a game talking to a ScoreServer. Events are sent as they happen
+    # and the server batches them; if the server goes away a game's client (fall_back=True) falls
+    # back to writing the database itself through a local ScoreWriter, while a client only used for
+    # reads just stops being used.
+    def __init__(self, address, fall_back=True):
+        self.address = address
+        self.sock = scoreServerSocket(address)
+        self.replies = self.sock.makefile("rb")
+        self.lock = threading.Lock()
+        self.fall_back = fall_back
+        self.connected = True
+        self.fallback = None
+
+    def send(self, message, reply=False):
+        with self.lock:
+            if self.connected:
+                try:
+                    self.sock.sendall(json.dumps(message).encode() + b"\n")
+                    if reply:
+                        line = self.replies.readline()
+                        if not line:
+                            raise ConnectionError("score server closed the connection")
+                        return json.loads(line)
+                    return None
+                except OSError as e:
+                    print(f"Failed to reach score server at {self.address}: {e}")
+                    self.sock.close()
+                    self.connected = False
+                    if self.fall_back:
+                        self.fallback = ScoreWriter(DATABASE_FILE)
+        return None
+
+    def submit(self, username, score):
+        self.send({"op": "score", "user": username, "score": score})
+        if self.fallback:
+            self.fallback.submit(username, score)
+
+    def record_game(self, username, score, won):
+        at = time.time()
+        self.send({"op": "game", "user": username, "score": score, "won": bool(won), "at": at})
+        if self.fallback:
+            self.fallback.record_game(username, score, won)
+
+    def flush(self, wait=False):
+        self.send({"op": "flush", "reply": wait}, reply=wait)
+        if self.fallback:
+            self.fallback.flush(wait)
+
+    def leaderboard(self, limit=100, after=None):
+        reply = self.send({"op": "leaderboard", "limit": limit, "after": list(after) if after else None}, reply=True)
+        if reply is None or "rows" not in reply:
+            raise ConnectionError("no leaderboard from score server")
+        return [tuple(row) for row in reply["rows"]], tuple(reply["cursor"]) if reply["cursor"] else None
+
+    def rank(self, username):
+        reply = self.send({"op": "rank", "user": username}, reply=True)
+        if reply is None or "rank" not in reply:
+            raise ConnectionError("no rank from score server")
+        return reply["rank"]
+
+    def close(self):
+        with self.lock:
+            if self.connected:
+                self.sock.close()
+        if self.fallback:
+            self.fallback.close()
+
+
+score_writer = None
+
+
+def get_score_writer():
+    global score_writer
+    if score_writer is None:
+        if SCORE_SERVER:
+            try:
+                score_writer = ScoreClient(SCORE_SERVER)
+            except OSError as e:
+                print(f"Failed to connect to score server at {SCORE_SERVER}: {e}")
+        if score_writer is None:
+            score_writer = ScoreWriter()
+        atexit.register(score_writer.close)
+    return score_writer
+
+
+def main_score_server(args):
+    server = ScoreServer()
+    try:
+        asyncio.run(server.serve(args.score_server))
+    except KeyboardInterrupt:
+        print("Score server stopped")
+
+
+def main_headless(args):
+    profiler = FrameProfiler(args.profile) if args.profile else None
+    game = GameRound(args.ghosts, ai=args.ghost_ai)
+    if args.record:
+        game.recorder = InputRecorder(args.record, args.seed or 0, len(game.ghost_sprites), game.ai, game.turn_buffer)
+    ticks = 0
+    seconds = 0.0
+    results = []
+    for game_index in range(args.games):
+        seed = None if args.seed is None else args.seed + game_index
+        result = run_headless(RandomInput(seed), args.max_ticks, profiler=profiler, game=game)
+        results.append(result)
+        ticks += result["ticks"]
+        seconds += result["seconds"]
+
+    wins = sum(1 for result in results if result["status"] == "won")
+    losses = sum(1 for result in results if result["status"] == "lost")
+    mean_score = sum(result["score"] for result in results) / len(results)
+    print(f"games: {len(results)}  won: {wins}  lost: {losses}  timeout: {len(results) - wins - losses}")
+    print(f"mean score: {mean_score:.1f}/{results[0]['total']}")
+    print(f"ticks: {ticks}  seconds: {seconds:.3f}  ticks/s: {ticks / seconds if seconds > 0 else 0.0:.0f}")
+    if profiler:
+        for phase in ["player", "ghosts", "pellets"]:
+            mean, p95 = profiler.stats(phase)
+            print(f"{phase}: mean {mean * 1000:.1f} us  p95 {p95 * 1000:.1f} us")
+        profiler.close()
+    if game.recorder:
+        game.recorder.close()
+
+
+def main_vector(args):
+    # Plays random actions in args.envs games spread over args.workers processes for
+    # args.max_ticks steps and reports the environment throughput
+    envs = VectorEnv(args.envs, args.workers, args.map, args.ghosts, args.ghost_ai, args.max_ticks)
+    rng = np.random.default_rng(args.seed)
+    finished = []
+    try:
+        envs.reset()
+        start = time.perf_counter()
+        for _ in range(args.max_ticks):
+            _, _, dones, infos = envs.step(rng.integers(len(env_actions), size=args.envs))
+            finished += infos["score"][dones].tolist()
+        elapsed = time.perf_counter() - start
+    finally:
+        envs.close()
+
+    steps = args.envs * args.max_ticks
+    print(f"envs: {args.envs}  workers: {envs.workers}  games finished: {len(finished)}")
+    if finished:
+        print(f"mean score: {sum(finished) / len(finished):.1f}")
+    print(f"steps: {steps}  seconds: {elapsed:.3f}  steps/s: {steps / elapsed if elapsed > 0 else 0.0:.0f}")
+
+
+def main_replay(args):
+    # Replays recordings and checks every finished round reaches the recorded ticks and score
+    view_factory = None
+    if args.render_every:
+        pygame.display.init()
+        screen = pygame.display.set_mode(screenSize(load_map()))
+        pygame.display.set_caption('Pacman replay')
+        assets.preload()
+        font = assets.font("freesansbold.ttf", 24)
+        view_factory = lambda game: makeView(screen, game, font)
+
+    rounds = 0
+    mismatched = 0
+    ticks = 0
+    seconds = 0.0
+    for path in args.replay:
+        try:
+            results = replay_recording(path, args.max_ticks, view_factory, args.render_every or 1)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Failed to replay {path}: {e}")
+            mismatched += 1
+            continue
+        for index, (recorded, result) in enumerate(results):
+            rounds += 1
+            ticks += result["ticks"]
+            seconds += result["seconds"]
+            if recorded["status"] is None:
+                print(f"{path} round {index + 1}: unfinished, replayed to {result['status']} "
+                      f"at tick {result['ticks']} with score {result['score']}")
+                continue
+            expected_status = recorded["status"] if recorded["status"] in ("won", "lost") else "timeout"
+            if (result["status"], result["ticks"], result["score"]) != (expected_status, recorded["ticks"], recorded["score"]):
+                mismatched += 1
+                print(f"{path} round {index + 1}: recorded {recorded['status']} at tick {recorded['ticks']} "
+                      f"with score {recorded['score']}, replayed {result['status']} at tick {result['ticks']} "
+                      f"with score {result['score']}")
+
+    print(f"recordings: {len(args.replay)}  rounds: {rounds}  mismatched: {mismatched}")
+    print(f"ticks: {ticks}  seconds: {seconds:.3f}  ticks/s: {ticks / seconds if seconds > 0 else 0.0:.0f}")
+    if args.render_every:
+        pygame.display.quit()
+    return mismatched
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pacman")
+    parser.add_argument("--headless", action="store_true", help="simulate games without a window, audio or frame cap")
+    parser.add_argument("--games", type=int, default=1, help="number of headless games to simulate")
+    parser.add_argument("--max-ticks", type=int, default=10000, help="tick limit per headless game")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the random headless input")
+    parser.add_argument("--profile", default=None, help="stream per-tick phase timings to this JSONL file")
+    parser.add_argument("--ghosts", type=int, default=None, help=f"number of ghosts (default {ghost_count})")
+    parser.add_argument("--record", default=None, help="record the headless games' input to this file")
+    parser.add_argument("--replay", nargs="+", default=None, help="replay recordings and verify their scores")
+    parser.add_argument("--render-every", type=int, default=0, help="draw every Nth tick of a replay (0 = no window)")
+    parser.add_argument("--ghost-ai", choices=ghost_ais, default=ghost_ai, help=f"ghost behaviour (default {ghost_ai})")
+    parser.add_argument("--envs", type=int, default=0, help="step this many headless games with random actions in parallel")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes for --envs (default: CPU count)")
+    parser.add_argument("--score-server", default=None,
+                        help="run the score service on unix:/path/to.sock or host:port (games use PACMAN_SCORE_SERVER)")
+    parser.add_argument("--map", default=map_file, help=f"map file to play (default {map_file})")
+    args = parser.parse_args()
+
+    # Also passed on through the environment to the game process
+    map_file = os.environ["PACMAN_MAP"] = args.map
+    if args.ghosts is not None:
+        ghost_count = args.ghosts
+        os.environ["PACMAN_GHOSTS"] = str(args.ghosts)
+
+    if args.replay:
+        sys.exit(1 if main_replay(args) else 0)
+
+    if args.score_server:
+        main_score_server(args)
+        sys.exit(0)
+
+    if args.envs:
+        main_vector(args)
+        sys.exit(0)
+
+    if args.headless:
+        main_headless(args)
+        sys.exit(0)
+
     initialize_database()
     my_app = MyApp()
     sys.exit(my_app.app.exec())
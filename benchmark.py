@@ -0,0 +1,310 @@
+import os
+import sys
+import gc
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+
+# Everything runs without a real window or sound card
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import pygame
+import Game
+
+BASELINE_FILE = "benchmark_baseline.json"
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def measure(function, samples, number):
+    # Each sample times `number` back-to-back calls; results are microseconds per call
+    for _ in range(max(1, samples // 10)):
+        function()
+    timings = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(samples):
+            start = time.perf_counter_ns()
+            for _ in range(number):
+                function()
+            timings.append((time.perf_counter_ns() - start) / number / 1000.0)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    timings.sort()
+    return {
+        "median_us": percentile(timings, 0.5),
+        "p95_us": percentile(timings, 0.95),
+        "p99_us": percentile(timings, 0.99),
+        "samples": samples,
+        "number": number,
+    }
+
+
+def bench_player_update():
+    game = Game.GameRound()
+    pacman = game.Pacman
+    moves = [(30, 0), (-30, 0), (0, 30), (0, -30)]
+    state = {"move": 0}
+
+    def run():
+        pacman.change_x, pacman.change_y = moves[state["move"] % 4]
+        state["move"] += 1
+        pacman.update(game.wall_grid, game.gate_grid)
+    return run, 200
+
+
+def bench_ghost_step():
+    game = Game.GameRound()
+    return (lambda: game.ghosts.step(game.Pacman)), 50
+
+
+def bench_ghost_step_64():
+    # Chase decisions are table lookups, so this should stay close to ghost_step
+    game = Game.GameRound(64)
+    return (lambda: game.ghosts.step(game.Pacman)), 50
+
+
+def bench_map_compile():
+    # Cold compile of the map file, as paid when the map changed since its cache was written
+    with open(Game.map_file) as map_source:
+        source = json.load(map_source)
+    return (lambda: Game.compileMap(source)), 1
+
+
+def bench_map_load():
+    # Loading the compiled map from its on-disk cache, as paid by every new game process
+    Game.load_map()
+
+    def run():
+        Game.mazes.clear()
+        Game.load_map()
+    return run, 5
+
+
+def bench_round_reset():
+    game = Game.GameRound()
+    return game.reset, 20
+
+
+def bench_snapshot():
+    game = Game.GameRound()
+    for tick in range(20):
+        game.tick()
+    return game.snapshot, 1000
+
+
+def bench_restore():
+    # Alternates between two mid-game snapshots, so pellets and ghost cursors change every time
+    game = Game.GameRound()
+    game.handle_key(Game.pygame.KEYDOWN, Game.pygame.K_LEFT)
+    snapshots = []
+    for tick in range(10):
+        game.tick()
+        if tick in (4, 9):
+            snapshots.append(game.snapshot())
+    state = {"next": 0}
+
+    def run():
+        state["next"] ^= 1
+        game.restore(snapshots[state["next"]])
+    return run, 1000
+
+
+def bench_game_tick():
+    game = Game.GameRound()
+    inputs = Game.RandomInput(0)
+
+    def run():
+        for event_type, key in inputs.poll(game.ticks):
+            game.handle_key(event_type, key)
+        if game.tick() is not None:
+            game.reset()
+    return run, 50
+
+
+def bench_env_step():
+    # One environment step including building the observation arrays
+    env = Game.PacmanEnv()
+    env.reset()
+    actions = [1, 2, 3, 4]
+    state = {"step": 0}
+
+    def run():
+        state["step"] += 1
+        if env.step(actions[state["step"] // 4 % 4])[2]:
+            env.reset()
+    return run, 50
+
+
+def bench_frame():
+    # One game tick plus everything drawn and presented for it
+    screen = pygame.display.set_mode(Game.load_map().size)
+    Game.assets.preload()
+    game = Game.GameRound()
+    view = Game.GameView(screen, game, Game.assets.font("freesansbold.ttf", 24))
+    view.start_round()
+    inputs = Game.RandomInput(0)
+
+    def run():
+        for event_type, key in inputs.poll(game.ticks):
+            game.handle_key(event_type, key)
+        old_score = game.score
+        view.before_tick()
+        status = game.tick()
+        pygame.display.update(view.draw(game.eaten, game.score != old_score, 1.0))
+        if status is not None:
+            game.reset()
+            view.start_round()
+    return run, 10
+
+
+def bench_update_user_score():
+    state = {"score": 0}
+
+    def run():
+        state["score"] += 1
+        Game.update_user_score("bench_user_1", state["score"])
+    return run, 1
+
+
+def bench_score_writer_submit():
+    writer = Game.ScoreWriter(Game.DATABASE_FILE, flush_interval=0.5)
+    state = {"score": 0}
+
+    def run():
+        state["score"] += 1
+        writer.submit("bench_user_2", state["score"])
+    return run, 100
+
+
+def bench_load_user_data():
+    store = Game.get_account_store()
+    return (lambda: store.best_score("bench_user_3")), 10
+
+
+def bench_login_user():
+    # Dominated by the scrypt cost on purpose; the first call upgrades the plaintext fixture password
+    return (lambda: Game.check_credentials("bench_user_3", "password3")), 1
+
+
+def bench_register_taken():
+    # Also a regression check: a taken name must not leave its pooled connection holding the
+    # write lock, so another connection has to be able to write right after
+    store = Game.get_account_store()
+    other = Game.sqlite3.connect(Game.DATABASE_FILE, timeout=0)
+
+    def run():
+        if store.register("bench_user_4", "password4"):
+            raise AssertionError("registered a taken username")
+        other.execute('UPDATE users SET best_score = best_score WHERE username = ?', ("bench_user_4",))
+        other.commit()
+    return run, 1
+
+
+benchmarks = [
+    ("player_update", bench_player_update),
+    ("ghost_step", bench_ghost_step),
+    ("ghost_step_64", bench_ghost_step_64),
+    ("map_compile", bench_map_compile),
+    ("map_load", bench_map_load),
+    ("round_reset", bench_round_reset),
+    ("snapshot", bench_snapshot),
+    ("restore", bench_restore),
+    ("game_tick", bench_game_tick),
+    ("env_step", bench_env_step),
+    ("frame", bench_frame),
+    ("update_user_score", bench_update_user_score),
+    ("score_writer_submit", bench_score_writer_submit),
+    ("load_user_data", bench_load_user_data),
+    ("login_user", bench_login_user),
+    ("register_taken", bench_register_taken),
+]
+
+
+def setup_database(directory, users):
+    # Benchmarks never touch wallet.db; they run against a scratch copy filled with fake users
+    Game.DATABASE_FILE = os.path.join(directory, "bench.db")
+    if os.path.exists("wallet.db") and os.path.getsize("wallet.db") > 0:
+        shutil.copyfile("wallet.db", Game.DATABASE_FILE)
+    Game.initialize_database()
+    rng = random.Random(0)
+    conn = Game.sqlite3.connect(Game.DATABASE_FILE)
+    conn.executemany('INSERT OR IGNORE INTO users (username, password, best_score) VALUES (?, ?, ?)',
+                     [(f"bench_user_{index}", f"password{index}", rng.randint(0, 200)) for index in range(users)])
+    conn.commit()
+    conn.close()
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if previous and result["median_us"] > previous["median_us"] * (1.0 + threshold):
+            regressions.append((name, previous["median_us"], result["median_us"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pacman performance benchmarks")
+    parser.add_argument("--samples", type=int, default=200, help="timed samples per benchmark")
+    parser.add_argument("--only", nargs="*", help="run only these benchmarks")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="save this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fail if a median is this fraction slower than the baseline (default 0.25)")
+    parser.add_argument("--users", type=int, default=10000, help="fake users in the scratch database")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="pacman-bench-")
+    try:
+        setup_database(directory, args.users)
+        results = {}
+        print(f"{'benchmark':<22}{'median us':>12}{'p95 us':>12}{'p99 us':>12}")
+        for name, setup in benchmarks:
+            if args.only and name not in args.only:
+                continue
+            function, number = setup()
+            results[name] = measure(function, args.samples, number)
+            result = results[name]
+            print(f"{name:<22}{result['median_us']:>12.2f}{result['p95_us']:>12.2f}{result['p99_us']:>12.2f}")
+    finally:
+        if Game.score_writer is not None:
+            Game.score_writer.close()
+        if Game.account_store is not None:
+            Game.account_store.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.save:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump({"python": platform.python_version(), "platform": platform.platform(),
+                       "pygame": pygame.version.ver, "benchmarks": results}, baseline_file, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save to create one")
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        regressions = compare(results, json.load(baseline_file), args.threshold)
+    for name, before, after in regressions:
+        print(f"REGRESSION {name}: median {before:.2f} us -> {after:.2f} us")
+    if regressions:
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%} of {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())